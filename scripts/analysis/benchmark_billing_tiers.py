@@ -0,0 +1,98 @@
+"""Benchmark the billing tier lookup of autoscaling-profiles-limits.py.
+
+Compares the BillingTiers bisect lookup with a linear scan of the tiers, for every
+service and for growing tier tables.
+
+Usage:
+    python scripts/analysis/benchmark_billing_tiers.py [--lookups 10000]
+"""
+
+import argparse
+import random
+import time
+
+from snippet_loader import load_snippet
+
+SERVICES = [
+    "input",
+    "output",
+    "analysis",
+    "data_records",
+    "sms",
+    "email",
+    "run_users",
+    "push_notification",
+    "file_storage",
+]
+TIER_COUNTS = [10, 100, 1_000, 10_000, 100_000]
+
+
+def build_prices(tier_count: int) -> dict:
+    prices = {
+        "plans": [{"name": "scale", "price": 90}],
+        "addons": [{"name": "mobile", "price": 25}],
+    }
+    for service in SERVICES:
+        tiers = [
+            {"amount": amount, "price": amount / 1000}
+            for amount in range(1000, 1000 * (tier_count + 1), 1000)
+        ]
+        random.shuffle(tiers)
+        prices[service] = tiers
+    return prices
+
+
+def linear_next_amount(prices: dict, service: str, limit: float):
+    # The previous check_auto_scale lookup, on tiers that are already sorted.
+    tier = next((tier for tier in prices[service] if tier["amount"] > limit), None)
+    return tier["amount"] if tier else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=10_000)
+    args = parser.parse_args()
+
+    autoscaling = load_snippet("autoscaling-profiles-limits")
+    random.seed(1)
+
+    print(f"{'tiers':>8} {'build':>10} {'bisect/lookup':>14} {'linear/lookup':>14}")
+    for tier_count in TIER_COUNTS:
+        prices = build_prices(tier_count)
+        queries = [
+            (random.choice(SERVICES), random.uniform(0, 1000 * (tier_count + 1)))
+            for _ in range(args.lookups)
+        ]
+
+        start = time.perf_counter()
+        tiers = autoscaling.BillingTiers(prices)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = [tiers.next_amount(service, limit) for service, limit in queries]
+        bisect_time = (time.perf_counter() - start) / len(queries)
+
+        # The linear scan is slow on large tables, so it runs on fewer lookups.
+        sample = queries[: max(10, args.lookups // tier_count)]
+        sorted_prices = {
+            service: sorted(prices[service], key=lambda tier: tier["amount"])
+            for service in SERVICES
+        }
+        start = time.perf_counter()
+        expected = [
+            linear_next_amount(sorted_prices, service, limit)
+            for service, limit in sample
+        ]
+        linear_time = (time.perf_counter() - start) / len(sample)
+
+        if results[: len(sample)] != expected:
+            raise AssertionError(f"Lookups differ from the linear scan ({tier_count})")
+
+        print(
+            f"{tier_count:>8} {build * 1000:>8.1f}ms "
+            f"{bisect_time * 1e6:>12.2f}us {linear_time * 1e6:>12.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Measure the cold start of the Python snippets and check it against their budgets.
+
+Every run of a scheduled analysis starts a new interpreter and imports the snippet
+modules again, so the import time is paid on each run. Each snippet, without its
+Analysis(...).init line, runs in a new interpreter with -X importtime, and the
+cumulative time of its top level imports is added up, leaving out the modules that an
+empty interpreter imports too.
+
+Every snippet imports tagoio_sdk, and the import time of a whole interpreter changes a lot
+from run to run with the load of the machine. So each run of a snippet is paired with a
+run of "import tagoio_sdk", and the budget of the snippet in import_budgets.json is for
+the median time above that baseline, the imports the snippet adds to the SDK. The script
+fails when any snippet is over budget.
+
+Usage:
+    python scripts/analysis/benchmark_imports.py [--runs 5] [--snippets find,console]
+    python scripts/analysis/benchmark_imports.py --update   # measure new budgets
+"""
+
+import argparse
+import json
+import math
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from snippet_loader import INIT_LINE, RUNTIME, SNIPPETS_DIR, snippet_path
+
+BUDGETS_FILE = Path(__file__).with_name("import_budgets.json")
+# Budgets measured with --update are the time above the SDK with this margin, plus the
+# headroom for the noise of the measure, in steps of 10 ms.
+BUDGET_MARGIN = 1.5
+BUDGET_HEADROOM_MS = 30
+SDK_IMPORT = ["-c", "import tagoio_sdk"]
+
+IMPORT_LINE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def parse_importtime(output: str) -> dict[str, int]:
+    """Cumulative microseconds of each top level import in the -X importtime output."""
+    imports = {}
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and not match.group(2):
+            imports[match.group(3)] = int(match.group(1))
+    return imports
+
+
+def run_importtime(args: list[str]) -> tuple[dict[str, int], float]:
+    """Run a new interpreter with -X importtime and return its imports and wall ms."""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if process.returncode:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return parse_importtime(process.stderr), wall_ms
+
+
+def import_ms(args: list[str], baseline: set[str]) -> tuple[float, float, dict]:
+    """Import ms of a new interpreter without the baseline modules, wall ms and imports."""
+    imports, wall_ms = run_importtime(args)
+    imports = {
+        name: microseconds
+        for name, microseconds in imports.items()
+        if name not in baseline
+    }
+    return sum(imports.values()) / 1000, wall_ms, imports
+
+
+def measure(script: Path, runs: int, baseline: set[str]) -> dict:
+    """Median import, SDK and wall time of a script, and its heaviest imports."""
+    samples = []
+    for _ in range(runs):
+        # The SDK runs right before the script, under the same load of the machine.
+        sdk_ms = import_ms(SDK_IMPORT, baseline)[0]
+        script_ms, wall_ms, imports = import_ms([str(script)], baseline)
+        samples.append((script_ms - sdk_ms, script_ms, sdk_ms, wall_ms, imports))
+
+    samples.sort(key=lambda sample: sample[0])
+    extra_ms, script_ms, sdk_ms, _wall_ms, imports = samples[len(samples) // 2]
+    heaviest = sorted(imports.items(), key=lambda item: -item[1])[:3]
+    return {
+        "extra_ms": round(extra_ms, 1),
+        "import_ms": round(script_ms, 1),
+        "sdk_ms": round(sdk_ms, 1),
+        "wall_ms": round(statistics.median(sample[3] for sample in samples), 1),
+        "heaviest": {
+            name: round(microseconds / 1000, 1) for name, microseconds in heaviest
+        },
+    }
+
+
+def snippet_names() -> list[str]:
+    return sorted(path.stem for path in (SNIPPETS_DIR / RUNTIME).glob("*.py"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--snippets", default=",".join(snippet_names()))
+    parser.add_argument(
+        "--update", action="store_true", help="Write the measured budgets"
+    )
+    args = parser.parse_args()
+
+    budgets = json.loads(BUDGETS_FILE.read_text()) if BUDGETS_FILE.exists() else {}
+    baseline = set(run_importtime(["-c", "pass"])[0])
+    names = [name.strip() for name in args.snippets.split(",") if name.strip()]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            # The snippet runs as a script, without connecting to TagoIO.
+            script = Path(tmp) / f"{name}.py"
+            script.write_text(INIT_LINE.sub("", snippet_path(name).read_text()))
+            results[name] = measure(script, args.runs, baseline)
+
+    print(
+        f"{'snippet':<48} {'+sdk ms':>8} {'budget':>7} {'import ms':>9} "
+        f"{'sdk ms':>7} {'wall ms':>8}  heaviest"
+    )
+    over_budget = []
+    for name, result in results.items():
+        budget = budgets.get(name)
+        if budget is not None and result["extra_ms"] > budget:
+            over_budget.append(name)
+        heaviest = ", ".join(
+            f"{module} {ms}" for module, ms in result["heaviest"].items()
+        )
+        print(
+            f"{name:<48} {result['extra_ms']:>8.1f} {budget or '-':>7} "
+            f"{result['import_ms']:>9.1f} {result['sdk_ms']:>7.1f} "
+            f"{result['wall_ms']:>8.1f}  {heaviest}"
+            + ("  OVER BUDGET" if name in over_budget else "")
+        )
+
+    if args.update:
+        for name, result in results.items():
+            extra_ms = max(result["extra_ms"], 0) * BUDGET_MARGIN + BUDGET_HEADROOM_MS
+            budgets[name] = math.ceil(extra_ms / 10) * 10
+        BUDGETS_FILE.write_text(
+            json.dumps(dict(sorted(budgets.items())), indent=2) + "\n"
+        )
+        print(f"Budgets written to {BUDGETS_FILE.name}")
+    elif over_budget:
+        sys.exit(f"Over the import budget: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
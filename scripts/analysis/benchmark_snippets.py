@@ -0,0 +1,484 @@
+"""Benchmark the Python analysis snippets against the TagoIO emulator.
+
+Each snippet runs in its own process, against a new emulator seeded for the run: a fleet
+of devices for the snippets that go through the devices of an account, or a single device
+with many records for the snippets that read a device. The snippets triggered by an action
+or a dashboard get a scope, such as the seeded records. Every run records the wall time,
+the API calls and bytes by endpoint, and the peak memory of the process. The results are
+written as JSON, so the runs of two commits can be compared with --compare.
+
+Usage:
+    python scripts/analysis/benchmark_snippets.py [--fleet 10,100,1000]
+        [--depth 10,1000,10000] [--snippets find,fleet-email-export] [--latency 0]
+        [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+from snippet_loader import load_analysis
+from tagoio_emulator import TagoIOEmulator
+
+ANALYSIS_TOKEN = "benchmark-analysis-token"
+TAG = {"key": "fleet", "value": "benchmark"}
+# Records of each variable in every device of a fleet.
+FLEET_RECORDS = 10
+# Start date that includes every seeded record, which are one minute apart.
+START_DATE = "3 years"
+
+# Snippets without a scenario, and why they can't run against the emulator.
+EXCLUDED = {
+    "autoscaling-profiles-limits": "uses Account.profile, missing in tagoio-sdk 5",
+    "downlink-dashboard": "posts to the middleware of a LoRaWAN network server",
+    "dynamic-notification": "returns before any request when account_token is set",
+    "http-get": "requests the public TagoIO API at a fixed URL",
+}
+
+
+@dataclass
+class Fixture:
+    """Tokens and address of a seeded emulator, used to build the environment."""
+
+    url: str
+    account_token: str
+    device_token: str
+    device_id: str
+    size: int
+
+
+@dataclass
+class Scenario:
+    """How to seed the emulator and configure one snippet.
+
+    Args:
+        axis (str): "fleet" seeds size devices with FLEET_RECORDS records each, and
+            "depth" seeds one device with size records of each variable
+        variables (tuple[str, ...]): Variables of the seeded records
+        environment (Callable): Environment variables of the snippet for a fixture
+        scope (Callable): Scope of the analysis for a fixture, empty by default
+        unit (str): Unit of the seeded records (OPTIONAL)
+    """
+
+    axis: str
+    variables: tuple[str, ...]
+    environment: Callable[[Fixture], dict]
+    scope: Callable[[Fixture], list] = lambda _fixture: []
+    unit: Optional[str] = None
+
+
+def scope_of(variable: str, fixture: Fixture, count: Optional[int] = None) -> list:
+    """Scope of an action with count records of the variable, one for each record."""
+    return [
+        {
+            "variable": variable,
+            "value": round(60 + (position % 100) / 10, 1),
+            "device": fixture.device_id,
+            "time": time.time() - position * 60,
+        }
+        for position in range(fixture.size if count is None else count)
+    ]
+
+
+def form_scope(fixture: Fixture, **values) -> list:
+    """Scope of a dashboard form, with one record for each value."""
+    return [
+        {"variable": variable, "value": value, "device": fixture.device_id}
+        for variable, value in values.items()
+    ]
+
+
+SCENARIOS = {
+    # Snippets that read a device
+    "find": Scenario(
+        "depth", ("temperature",), lambda f: {"device_token": f.device_token}
+    ),
+    "avg-min-max": Scenario(
+        "depth", ("temperature",), lambda f: {"device_token": f.device_token}
+    ),
+    "email-export": Scenario(
+        "depth",
+        ("fuel_level",),
+        lambda f: {"device_token": f.device_token, "email": "user@example.com"},
+    ),
+    "unit-conversion": Scenario(
+        "depth",
+        ("temperature",),
+        lambda f: {"device_token": f.device_token, "variables": "temperature"},
+        unit="F",
+    ),
+    "derived-variables": Scenario(
+        "depth",
+        ("temperature", "humidity"),
+        lambda f: {"device_token": f.device_token, "start_date": START_DATE},
+    ),
+    "generate-pdf-report": Scenario(
+        "depth",
+        ("your_variable",),
+        lambda f: {
+            "device_token": f.device_token,
+            "email": "user@example.com",
+            "start_date": START_DATE,
+            "pdf_service_url": f"{f.url}/pdf",
+        },
+    ),
+    # Snippets triggered by an action or a dashboard, with a scope
+    "console": Scenario(
+        "depth",
+        ("temperature",),
+        lambda f: {"device_token": f.device_token},
+        scope=lambda f: scope_of("temperature", f),
+    ),
+    "structured-logger": Scenario(
+        "depth",
+        ("temperature",),
+        lambda f: {"device_token": f.device_token},
+        scope=lambda f: scope_of("temperature", f),
+    ),
+    "mqtt-push": Scenario(
+        "depth",
+        ("push_payload",),
+        lambda _f: {"codec": "json"},
+        scope=lambda f: scope_of("push_payload", f),
+    ),
+    "create-device": Scenario(
+        "depth",
+        ("temperature",),
+        lambda f: {"account_token": f.account_token},
+        scope=lambda f: form_scope(
+            f,
+            device_network="network-id",
+            device_connector="connector-id",
+            device_name="New device",
+            device_eui="0004A30B001C0530",
+        ),
+    ),
+    # Snippets that only use the analysis services or other hosts
+    "send-notification": Scenario(
+        "depth",
+        ("temperature",),
+        lambda _f: {"title": "Benchmark", "message": "Notification of the benchmark"},
+    ),
+    "http-fan-out": Scenario(
+        "depth",
+        ("temperature",),
+        # Without a token the emulator answers 401, enough to time the requests.
+        lambda f: {
+            "endpoints": ",".join(
+                f"{f.url}/info?request={position}" for position in range(f.size)
+            )
+        },
+    ),
+    # Snippets that go through the devices of an account
+    "device-list": Scenario(
+        "fleet", ("temperature",), lambda f: {"account_token": f.account_token}
+    ),
+    "device-offline": Scenario(
+        "fleet",
+        ("temperature",),
+        lambda f: {
+            "account_token": f.account_token,
+            "check_in_time": "1",
+            "tag_key": TAG["key"],
+            "tag_value": TAG["value"],
+            "email_list": "user@example.com",
+        },
+    ),
+    "data-retention": Scenario(
+        "fleet", ("temperature",), lambda f: {"account_token": f.account_token}
+    ),
+    "data-transaction": Scenario(
+        "fleet",
+        ("temperature",),
+        lambda f: {"account_token": f.account_token, "device_token": f.device_token},
+    ),
+    "configuration-parameters-for-dynamic-last-value": Scenario(
+        "fleet", ("temperature",), lambda f: {"account_token": f.account_token}
+    ),
+    "fleet-email-export": Scenario(
+        "fleet",
+        ("temperature",),
+        lambda f: {
+            "account_token": f.account_token,
+            "email": "user@example.com",
+            "tag_key": TAG["key"],
+            "tag_value": TAG["value"],
+            "variables": "temperature",
+            "start_date": START_DATE,
+        },
+    ),
+}
+
+
+def sample_records(
+    variables: tuple[str, ...], count: int, now: float, unit: Optional[str] = None
+) -> list[dict]:
+    return [
+        {
+            "variable": variable,
+            "value": round(20 + (minute % 100) / 10, 1),
+            "unit": unit,
+            "time": now - minute * 60,
+        }
+        for variable in variables
+        for minute in range(count)
+    ]
+
+
+def seed_scenario(emulator: TagoIOEmulator, scenario: Scenario, size: int) -> Fixture:
+    """Create the account, the devices and the records of a run."""
+    account_token = emulator.add_account()
+    devices = size if scenario.axis == "fleet" else 1
+    records = FLEET_RECORDS if scenario.axis == "fleet" else size
+    now = time.time()
+
+    created = []
+    for position in range(devices):
+        device = emulator.add_device(
+            f"Device {position + 1:06d}",
+            tags=[
+                TAG,
+                {"key": "type", "value": "sensor"},
+                {"key": "user_email", "value": f"user{position % 10}@example.com"},
+                {"key": "keyOfTagWeWantToSearch", "value": "valueOfTagWeWantToSearch"},
+            ],
+        )
+        emulator.add_data(
+            device["id"],
+            sample_records(scenario.variables, records, now, scenario.unit),
+        )
+        created.append(device)
+
+    return Fixture(
+        emulator.url, account_token, created[0]["token"], created[0]["id"], size
+    )
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_child(spec_file: str, result_file: str) -> None:
+    """Run one snippet in this process and write its time and memory to result_file."""
+    with open(spec_file) as file:
+        spec = json.load(file)
+
+    analysis = load_analysis(spec["snippet"])
+    context = SimpleNamespace(
+        token=ANALYSIS_TOKEN,
+        environment=[
+            {"key": key, "value": value} for key, value in spec["environment"].items()
+        ],
+        log=print,
+    )
+
+    result = {"baseline_rss_kb": peak_rss_kb(), "error": None}
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            analysis(context, spec["scope"])
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        traceback.print_exc()
+    result["wall_seconds"] = round(time.perf_counter() - start, 4)
+    result["peak_rss_kb"] = peak_rss_kb()
+
+    with open(result_file, "w") as file:
+        json.dump(result, file)
+
+
+def run_scenario(name: str, size: int, latency: float, timeout: float) -> dict:
+    """Seed an emulator, run the snippet against it and collect the measures."""
+    scenario = SCENARIOS[name]
+    result = {"snippet": name, "axis": scenario.axis, "size": size}
+
+    with (
+        TagoIOEmulator(latency=latency) as emulator,
+        tempfile.TemporaryDirectory() as tmp,
+    ):
+        fixture = seed_scenario(emulator, scenario, size)
+        spec_file = os.path.join(tmp, "spec.json")
+        result_file = os.path.join(tmp, "result.json")
+        with open(spec_file, "w") as file:
+            json.dump(
+                {
+                    "snippet": name,
+                    "environment": scenario.environment(fixture),
+                    "scope": scenario.scope(fixture),
+                },
+                file,
+                default=str,
+            )
+
+        # The emulator sets TAGOIO_API, which the child process inherits.
+        command = [sys.executable, __file__, "--child", spec_file, result_file]
+        try:
+            process = subprocess.run(
+                command, capture_output=True, text=True, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            result["error"] = f"Timeout after {timeout:g}s"
+        else:
+            if os.path.exists(result_file):
+                with open(result_file) as file:
+                    result.update(json.load(file))
+            else:
+                result["error"] = process.stderr.strip().splitlines()[-1:] or "Crashed"
+
+        summary = emulator.summary()
+        result["calls"] = {
+            endpoint: stats["calls"]
+            for endpoint, stats in sorted(summary["endpoints"].items())
+        }
+        result["total_calls"] = summary["totals"]["calls"]
+        result["bytes_in"] = summary["totals"]["bytes_in"]
+        result["bytes_out"] = summary["totals"]["bytes_out"]
+
+    return result
+
+
+def growth(results: list[dict], field: str) -> dict:
+    """Exponent of field against the size of the runs, between the first and last size.
+
+    An exponent around 0 means the field doesn't depend on the size, around 1 means it
+    grows linearly, such as one request per device, and above that it grows faster.
+    """
+    exponents = {}
+    for name in dict.fromkeys(result["snippet"] for result in results):
+        runs = [
+            result
+            for result in results
+            if result["snippet"] == name and not result.get("error")
+        ]
+        runs.sort(key=lambda result: result["size"])
+        if len(runs) < 2 or runs[0]["size"] == runs[-1]["size"]:
+            continue
+        first, last = runs[0], runs[-1]
+        if not first.get(field) or not last.get(field):
+            continue
+        exponents[name] = round(
+            math.log(last[field] / first[field])
+            / math.log(last["size"] / first["size"]),
+            2,
+        )
+    return exponents
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_results(report: dict) -> None:
+    print(
+        f"{'snippet':<48} {'axis':>5} {'size':>8} {'wall s':>9} {'calls':>7} "
+        f"{'kB out':>9} {'peak MB':>8}"
+    )
+    for result in report["results"]:
+        print(
+            f"{result['snippet']:<48} {result['axis']:>5} {result['size']:>8} "
+            f"{result.get('wall_seconds', 0):>9.3f} {result['total_calls']:>7} "
+            f"{result['bytes_out'] / 1024:>9.1f} "
+            f"{result.get('peak_rss_kb', 0) / 1024:>8.1f}"
+            + (f"  {result['error']}" if result.get("error") else "")
+        )
+
+    print("\nGrowth of the API calls with the size (0 constant, 1 linear):")
+    for name, exponent in report["growth"]["total_calls"].items():
+        flag = "  <- calls grow with the size" if exponent >= 0.5 else ""
+        print(f"  {name:<48} {exponent:>5.2f}{flag}")
+
+
+def print_comparison(report: dict, previous: dict) -> None:
+    before = {
+        (result["snippet"], result["size"]): result for result in previous["results"]
+    }
+    print(f"\nCompared with {previous.get('commit') or 'the previous run'}:")
+    for result in report["results"]:
+        old = before.get((result["snippet"], result["size"]))
+        if not old:
+            continue
+        changes = []
+        for field in ("wall_seconds", "total_calls", "bytes_out", "peak_rss_kb"):
+            if old.get(field) and result.get(field) is not None:
+                change = (result[field] - old[field]) / old[field] * 100
+                changes.append(f"{field} {change:+.0f}%")
+        print(f"  {result['snippet']:<48} {result['size']:>8}  {', '.join(changes)}")
+
+
+def parse_sizes(text: str) -> list[int]:
+    return [int(size.replace("_", "")) for size in text.split(",") if size.strip()]
+
+
+def main() -> None:
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fleet", default="10,100,1000", help="Devices of each run")
+    parser.add_argument("--depth", default="10,1000,10000", help="Records of each run")
+    parser.add_argument("--snippets", default=",".join(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="File to write the results as JSON")
+    parser.add_argument("--compare", help="Results of a previous run to compare with")
+    args = parser.parse_args()
+
+    sizes = {"fleet": parse_sizes(args.fleet), "depth": parse_sizes(args.depth)}
+    names = [name.strip() for name in args.snippets.split(",") if name.strip()]
+    for name in names:
+        if name in EXCLUDED:
+            parser.error(f"{name} has no scenario, it {EXCLUDED[name]}")
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown snippets: {', '.join(unknown)}")
+
+    results = []
+    for name in names:
+        for size in sizes[SCENARIOS[name].axis]:
+            print(f"{name} {SCENARIOS[name].axis}={size}", file=sys.stderr)
+            results.append(run_scenario(name, size, args.latency, args.timeout))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "results": results,
+        "growth": {
+            field: growth(results, field) for field in ("total_calls", "wall_seconds")
+        },
+    }
+    print_results(report)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            print_comparison(report, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
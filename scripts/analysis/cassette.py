@@ -0,0 +1,257 @@
+"""Record the API requests of an analysis to a cassette file and replay them later.
+
+Every request of the SDK clients, such as Device, Account and Services, goes through
+apiRequest. While a Cassette is recording, each request is sent and its body, result,
+error and time are kept. While it's replaying, nothing is sent: each request is answered
+with a copy of the recorded result for the same method, path, query and token, optionally
+waiting the recorded time multiplied by time_scale. Replayed runs don't need the network
+and can't change any data, so they can be profiled and repeated with production-shaped
+traffic.
+
+The cassette is a JSON Lines file, compressed when its name ends with .gz. The tokens are
+replaced by aliases, such as token-1, in the requests, in the results and in the stored
+environment, so the file doesn't hold any credential.
+
+The PDF service and the downlink helper of the SDK don't use apiRequest, and are not
+recorded.
+
+Usage:
+    python scripts/analysis/cassette.py record find find.jsonl.gz --env device_token=...
+    python scripts/analysis/cassette.py replay find find.jsonl.gz [--time-scale 1]
+"""
+
+import argparse
+import copy
+import gzip
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Optional
+
+from snippet_loader import load_analysis
+from tagoio_sdk.common import tagoio_module
+from tagoio_sdk.infrastructure.api_request import TagoIORequestError
+
+# TagoIO tokens are UUIDs, such as the device and account tokens.
+TOKEN_PATTERN = re.compile(
+    r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE
+)
+
+
+class CassetteMiss(Exception):
+    """Raised on replay when a request was not recorded in the cassette."""
+
+
+def request_key(method: str, path: str, params, token: str) -> str:
+    return json.dumps(
+        [method.upper(), path, params or {}, token or ""], sort_keys=True, default=str
+    )
+
+
+def open_cassette(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """Record or replay the API requests of the SDK while the with block runs.
+
+    Args:
+        path (str): Cassette file, compressed when it ends with .gz
+        mode (str): "record" to send the requests and save them, "replay" to answer them
+            from the file
+        time_scale (float): On replay, multiplies the recorded time of each request,
+            0 answers at once and 1 takes as long as the recording
+        secrets (list[str]): Values replaced by aliases in the file, besides the UUIDs
+        environment (dict): Environment of the analysis, stored in the cassette when
+            recording and updated with the stored one when replaying
+        analysis_token (str): Token of the analysis, stored in the cassette like the
+            environment
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        time_scale: float = 0,
+        secrets: list[str] = (),
+        environment: Optional[dict] = None,
+        analysis_token: str = "",
+    ) -> None:
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid mode '{mode}', use 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.secrets = [secret for secret in [analysis_token, *secrets] if secret]
+        self.environment = environment or {}
+        self.analysis_token = analysis_token
+        self.lock = threading.Lock()
+        self.interactions = []
+        self.recorded = defaultdict(deque)
+        self.last = {}
+        self.misses = []
+        self._original = None
+
+        if mode == "replay":
+            self.load()
+
+    # File
+
+    def load(self) -> None:
+        with open_cassette(self.path, "r") as file:
+            header = json.loads(file.readline())
+            self.environment = {**header.get("environment", {}), **self.environment}
+            self.analysis_token = header.get("analysis_token", "")
+            for line in file:
+                interaction = json.loads(line)
+                key = request_key(
+                    interaction["method"],
+                    interaction["path"],
+                    interaction.get("params"),
+                    interaction.get("token"),
+                )
+                self.recorded[key].append(interaction)
+                self.interactions.append(interaction)
+
+    def save(self) -> None:
+        header = {
+            "version": 1,
+            "analysis_token": self.analysis_token,
+            "environment": self.environment,
+        }
+        lines = [json.dumps(header)]
+        lines += [
+            json.dumps(interaction, default=str, separators=(",", ":"))
+            for interaction in self.interactions
+        ]
+        text = self.redact("\n".join(lines) + "\n")
+        with open_cassette(self.path, "w") as file:
+            file.write(text)
+
+    def redact(self, text: str) -> str:
+        aliases = {}
+
+        def alias(value: str) -> str:
+            return aliases.setdefault(value, f"token-{len(aliases) + 1}")
+
+        for secret in self.secrets:
+            text = text.replace(secret, alias(secret))
+        return TOKEN_PATTERN.sub(lambda match: alias(match.group(0)), text)
+
+    # Transport
+
+    def __enter__(self) -> "Cassette":
+        self._original = tagoio_module.apiRequest
+        tagoio_module.apiRequest = self.record if self.mode == "record" else self.replay
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        tagoio_module.apiRequest = self._original
+        if self.mode == "record":
+            self.save()
+
+    def record(self, params: dict):
+        interaction = {
+            "method": params["method"].upper(),
+            "path": params["path"],
+            "params": params.get("params") or {},
+            "token": params["headers"].get("token", ""),
+            "body": params.get("body"),
+        }
+        start = time.perf_counter()
+        try:
+            result = self._original(params)
+            # The SDK changes the result it gets, such as the dates parsed by dateParser,
+            # so the cassette keeps a copy of the result as it was received.
+            interaction["result"] = json.loads(json.dumps(result))
+        except TagoIORequestError as error:
+            interaction["error"] = error.message
+            raise
+        finally:
+            interaction["seconds"] = round(time.perf_counter() - start, 4)
+            if "result" in interaction or "error" in interaction:
+                with self.lock:
+                    self.interactions.append(interaction)
+        return result
+
+    def replay(self, params: dict):
+        key = request_key(
+            params["method"],
+            params["path"],
+            params.get("params"),
+            params["headers"].get("token"),
+        )
+        with self.lock:
+            if self.recorded[key]:
+                interaction = self.recorded[key].popleft()
+                self.last[key] = interaction
+            else:
+                # Requests repeated more times than recorded get the last answer.
+                interaction = self.last.get(key)
+            if interaction is None:
+                self.misses.append(f"{params['method'].upper()} {params['path']}")
+
+        if interaction is None:
+            raise CassetteMiss(
+                f"No recorded response for {params['method'].upper()} {params['path']}"
+            )
+        if self.time_scale:
+            time.sleep(interaction.get("seconds", 0) * self.time_scale)
+        if "error" in interaction:
+            raise TagoIORequestError(interaction["error"])
+        # A repeated request gets the same interaction, which the SDK would change.
+        return copy.deepcopy(interaction["result"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("snippet", help="File name of the snippet, without .py")
+    parser.add_argument("cassette", help="Cassette file, such as find.jsonl.gz")
+    parser.add_argument(
+        "--env", action="append", default=[], help="Environment variable, key=value"
+    )
+    parser.add_argument("--analysis-token", default="", help="Token of the analysis")
+    parser.add_argument("--time-scale", type=float, default=0)
+    args = parser.parse_args()
+
+    environment = dict(item.split("=", 1) for item in args.env)
+    cassette = Cassette(
+        args.cassette,
+        args.mode,
+        time_scale=args.time_scale,
+        secrets=[value for key, value in environment.items() if "token" in key],
+        environment=environment,
+        analysis_token=args.analysis_token,
+    )
+
+    analysis = load_analysis(args.snippet)
+    context = SimpleNamespace(
+        token=cassette.analysis_token,
+        environment=[
+            {"key": key, "value": value} for key, value in cassette.environment.items()
+        ],
+        log=print,
+    )
+
+    start = time.perf_counter()
+    with cassette:
+        analysis(context, [])
+    elapsed = time.perf_counter() - start
+
+    if args.mode == "record":
+        print(f"{len(cassette.interactions)} requests recorded in {elapsed:.2f}s")
+    else:
+        print(
+            f"{len(cassette.interactions)} requests replayed in {elapsed:.2f}s, "
+            f"{len(cassette.misses)} not recorded"
+        )
+
+
+if __name__ == "__main__":
+    main()
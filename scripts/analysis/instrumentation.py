@@ -0,0 +1,299 @@
+"""Count, time and profile the API requests of an analysis run.
+
+Wrap the analysis function with instrument(), and enable it for a run with the environment
+variable "instrument", such as instrument=calls or instrument=calls,cprofile,tracemalloc.
+Without the variable the analysis runs unchanged.
+
+This is a local tool, for the snippets loaded from this repository: an analysis deployed
+to TagoIO can't import this module, and no snippet wraps its analysis function. The command
+line runs a snippet with instrument=calls, unless --env instrument=... sets the options.
+
+While it's enabled, every request of the SDK clients is counted by endpoint, with the
+SDK method and the line of the analysis that called it, and timed in a latency
+histogram. The report at the end of the run also lists the identical requests sent more
+than once, and the requests sent many times from the same line, such as one request for
+each device in a loop (N+1). The "cprofile" and "tracemalloc" options add the functions
+that took the most time and the lines that allocated the most memory.
+
+Usage:
+    python scripts/analysis/instrumentation.py data-retention --env account_token=...
+        [--env instrument=calls,cprofile] [--cassette data-retention.jsonl.gz]
+"""
+
+import argparse
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from types import SimpleNamespace
+from typing import Callable
+
+import tagoio_sdk
+from cassette import Cassette
+from snippet_loader import load_analysis
+from tagoio_sdk.common import tagoio_module
+
+INSTRUMENT_KEY = "instrument"
+OPTIONS = {"calls", "cprofile", "tracemalloc"}
+
+# Device, profile and other ids in the paths, replaced by :id in the endpoints.
+ID_PATTERN = re.compile(
+    r"/(?:[0-9a-f]{24}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"
+    r"(?=/|$)",
+    re.IGNORECASE,
+)
+HISTOGRAM_MS = (5, 10, 25, 50, 100, 250, 500, 1000)
+# Requests of the same endpoint from the same line reported as a loop.
+LOOP_THRESHOLD = 10
+SDK_DIR = os.path.dirname(tagoio_sdk.__file__)
+
+
+def instrument_options(environment: list[dict]) -> set[str]:
+    """Options of the "instrument" environment variable, empty when it's not set."""
+    value = next(
+        (item["value"] for item in environment if item["key"] == INSTRUMENT_KEY), ""
+    )
+    options = {option.strip().lower() for option in value.split(",") if option.strip()}
+    unknown = options - OPTIONS
+    if unknown:
+        raise ValueError(f"Unknown instrument options: {', '.join(sorted(unknown))}")
+    # The requests are counted whenever the instrumentation is enabled.
+    return options | {"calls"} if options else options
+
+
+def endpoint_of(method: str, path: str) -> str:
+    return f"{method.upper()} {ID_PATTERN.sub('/:id', path)}"
+
+
+def call_site() -> tuple[str, str]:
+    """SDK method of the current request and the line of the analysis that called it."""
+    frame = sys._getframe(2)
+    sdk_frame = None
+    while frame and frame.f_code.co_filename.startswith(SDK_DIR):
+        sdk_frame = frame
+        frame = frame.f_back
+    method = getattr(sdk_frame.f_code, "co_qualname", "") if sdk_frame else ""
+    method = method or (sdk_frame.f_code.co_name if sdk_frame else "")
+    if frame is None:
+        return method, ""
+    return method, f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def histogram(latencies: list[float]) -> str:
+    buckets = Counter()
+    for latency in latencies:
+        bucket = next((limit for limit in HISTOGRAM_MS if latency < limit), None)
+        buckets[bucket] += 1
+    parts = [f"<{limit}ms:{buckets[limit]}" for limit in HISTOGRAM_MS if buckets[limit]]
+    if buckets[None]:
+        parts.append(f">={HISTOGRAM_MS[-1]}ms:{buckets[None]}")
+    return " ".join(parts)
+
+
+class Instrumentation:
+    """Count and time the API requests of the SDK while the with block runs."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.methods = defaultdict(set)
+        self.errors = Counter()
+        self.identical = Counter()
+        self.sites = Counter()
+        self._original = None
+
+    def __enter__(self) -> "Instrumentation":
+        self._original = tagoio_module.apiRequest
+        tagoio_module.apiRequest = self.request
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        tagoio_module.apiRequest = self._original
+
+    def request(self, params: dict):
+        method, site = call_site()
+        endpoint = endpoint_of(params["method"], params["path"])
+        identity = json.dumps(
+            [
+                params["path"],
+                params.get("params"),
+                params.get("body"),
+                params["headers"].get("token"),
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = self._original(params)
+            failed = False
+            return result
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.latencies[endpoint].append(elapsed)
+                self.methods[endpoint].add(method)
+                self.errors[endpoint] += failed
+                self.identical[(identity, endpoint, method, site)] += 1
+                self.sites[(endpoint, method, site)] += 1
+
+    def report(self) -> list[str]:
+        """Lines of the report: requests by endpoint, repeated requests and loops."""
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        errors = sum(self.errors.values())
+        total_ms = sum(sum(latencies) for latencies in self.latencies.values())
+        lines = [f"api calls={total} errors={errors} time_ms={total_ms:.1f}"]
+
+        for endpoint, latencies in sorted(
+            self.latencies.items(), key=lambda item: -sum(item[1])
+        ):
+            methods = ",".join(sorted(filter(None, self.methods[endpoint])))
+            lines.append(
+                f"  {endpoint} calls={len(latencies)} errors={self.errors[endpoint]} "
+                f"p50={percentile(latencies, 0.5):.1f}ms "
+                f"p95={percentile(latencies, 0.95):.1f}ms "
+                f"max={max(latencies):.1f}ms [{histogram(latencies)}] {methods}"
+            )
+
+        repeated = [
+            (count, endpoint, method, site)
+            for (_identity, endpoint, method, site), count in self.identical.items()
+            if count > 1
+        ]
+        if repeated:
+            lines.append("repeated identical calls:")
+            for count, endpoint, method, site in sorted(repeated, reverse=True):
+                lines.append(f"  {count}x {endpoint} {method} at {site}")
+
+        loops = [
+            (count, endpoint, method, site)
+            for (endpoint, method, site), count in self.sites.items()
+            if count >= LOOP_THRESHOLD
+        ]
+        if loops:
+            lines.append("calls in a loop (N+1):")
+            for count, endpoint, method, site in sorted(loops, reverse=True):
+                lines.append(f"  {count}x {endpoint} {method} at {site}")
+        return lines
+
+
+def profile_report(profiler: cProfile.Profile, limit: int = 15) -> list[str]:
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return ["cprofile:"] + [
+        f"  {line.strip()}"
+        for line in output.getvalue().splitlines()
+        if re.match(r"\s*[\d/]+\s+\d", line)
+    ]
+
+
+def tracemalloc_report(snapshot: tracemalloc.Snapshot, limit: int = 10) -> list[str]:
+    _current, peak = tracemalloc.get_traced_memory()
+    lines = [f"tracemalloc: peak_kb={peak / 1024:.1f}"]
+    # The allocations of the profiler and of this module are not from the analysis.
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, module.__file__)
+            for module in (cProfile, pstats, tracemalloc)
+        ]
+        + [tracemalloc.Filter(False, __file__)]
+    )
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"  {os.path.basename(frame.filename)}:{frame.lineno} "
+            f"size_kb={stat.size / 1024:.1f} count={stat.count}"
+        )
+    return lines
+
+
+def instrument(analysis: Callable) -> Callable:
+    """Run the analysis with the options of its "instrument" environment variable.
+
+    Args:
+        analysis (Callable): Analysis function, such as my_analysis
+
+    Returns:
+        Callable: The analysis function, which prints the report at the end of the run
+    """
+
+    @functools.wraps(analysis)
+    def run(context, scope: list = None):
+        options = instrument_options(context.environment)
+        if not options:
+            return analysis(context, scope)
+
+        # cProfile only sees the thread of the analysis, not the threads it starts.
+        profiler = cProfile.Profile() if "cprofile" in options else None
+        if "tracemalloc" in options:
+            tracemalloc.start()
+
+        instrumentation = Instrumentation()
+        try:
+            with instrumentation, profiler or nullcontext():
+                return analysis(context, scope)
+        finally:
+            lines = instrumentation.report()
+            if "tracemalloc" in options:
+                lines += tracemalloc_report(tracemalloc.take_snapshot())
+                tracemalloc.stop()
+            if profiler:
+                lines += profile_report(profiler)
+            # A single print is a single message in the analysis console.
+            print("\n".join(lines))
+
+    return run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("snippet", help="File name of the snippet, without .py")
+    parser.add_argument(
+        "--env", action="append", default=[], help="Environment variable, key=value"
+    )
+    parser.add_argument("--analysis-token", default="", help="Token of the analysis")
+    parser.add_argument("--cassette", help="Replay the requests from this cassette")
+    args = parser.parse_args()
+
+    environment = dict(item.split("=", 1) for item in args.env)
+    # The command line is only used to instrument a run, so the calls are always counted.
+    environment.setdefault(INSTRUMENT_KEY, "calls")
+    cassette = (
+        Cassette(args.cassette, "replay", environment=environment)
+        if args.cassette
+        else None
+    )
+    if cassette:
+        environment = cassette.environment
+
+    analysis = load_analysis(args.snippet)
+    context = SimpleNamespace(
+        token=cassette.analysis_token if cassette else args.analysis_token,
+        environment=[
+            {"key": key, "value": value} for key, value in environment.items()
+        ],
+        log=print,
+    )
+
+    with cassette or nullcontext():
+        instrument(analysis)(context, [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Load the Python analysis snippets as modules, without starting the analysis.
+
+Every snippet ends with ``Analysis(...).init(my_analysis)``, which connects to TagoIO.
+The loader executes the snippet source without that line, so its functions can be
+benchmarked and run locally.
+"""
+
+import re
+import types
+from pathlib import Path
+from typing import Callable
+
+SNIPPETS_DIR = Path(__file__).resolve().parents[2] / "snippets" / "analysis"
+RUNTIME = "python-rt2025"
+
+INIT_LINE = re.compile(r"^Analysis\(.*\)\.init\((.*)\)\s*$", re.MULTILINE)
+
+
+def snippet_path(name: str, runtime: str = RUNTIME) -> Path:
+    return SNIPPETS_DIR / runtime / f"{name}.py"
+
+
+def load_snippet(name: str, runtime: str = RUNTIME) -> types.ModuleType:
+    """Execute a snippet and return it as a module.
+
+    Args:
+        name (str): File name of the snippet, without .py
+        runtime (str): Runtime folder of the snippet
+
+    Returns:
+        types.ModuleType: The snippet, with my_analysis and its helpers
+    """
+    path = snippet_path(name, runtime)
+    source = INIT_LINE.sub("", path.read_text())
+    module = types.ModuleType(name.replace("-", "_"))
+    module.__file__ = str(path)
+    exec(compile(source, str(path), "exec"), module.__dict__)
+    return module
+
+
+def load_analysis(name: str, runtime: str = RUNTIME) -> Callable:
+    """Load a snippet and return the function it passes to Analysis(...).init.
+
+    Most snippets name it my_analysis, but not all of them, such as start_analysis.
+    """
+    match = INIT_LINE.search(snippet_path(name, runtime).read_text())
+    if not match:
+        raise ValueError(f"{name} doesn't start an analysis")
+    return getattr(load_snippet(name, runtime), match.group(1).strip())
@@ -0,0 +1,947 @@
+"""Local emulator of the TagoIO API used by the Python analysis snippets.
+
+The emulator is an HTTP server with the devices, data and services kept in memory. The
+SDK sends its requests to the URL in the TAGOIO_API environment variable when no region
+is given, so the snippets run against the emulator without any change:
+
+    with TagoIOEmulator(latency=0.02) as emulator:
+        device = emulator.add_device("Sensor", tags=[{"key": "type", "value": "sensor"}])
+        emulator.add_data(device["id"], [{"variable": "temperature", "value": 21}])
+        ...  # Device({"token": device["token"]}).getData(...) reaches the emulator
+
+Emulated endpoints:
+    Device token: /info, /data (get, post, delete), /device/params
+    Account token: /account, /device (list, create), /device/{id}, /device/{id}/data,
+    /device/{id}/params, /device/{id}/data_amount, /device/token/{id}, /profile,
+    /profile/{id}/summary, /profile/{id}/token, /pricing, /account/subscription,
+    /account/allocation
+    Any token: /analysis/services/{email,sms,mqtt,notification,console,attachment}/...
+    and POST /pdf, a stand-in for the PDF service (see generate-pdf-report.py)
+
+Usage:
+    python scripts/analysis/tagoio_emulator.py [--port 8080] [--devices 10] [--latency 0.05]
+"""
+
+import argparse
+import base64
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from dateutil import parser as date_parser
+
+MAX_QTY = 10000
+DEFAULT_QTY = 15
+# Query parameters that are always lists, even with a single value.
+LIST_PARAMS = {"variables", "groups", "ids", "values", "fields"}
+
+RELATIVE_DATE = re.compile(
+    r"^\s*(\d+)\s*(second|minute|hour|day|week|month|year)s?\s*$", re.IGNORECASE
+)
+RELATIVE_UNITS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+    "month": 30 * 86400,
+    "year": 365 * 86400,
+}
+
+SERVICES = ("email", "sms", "mqtt", "notification", "console", "attachment", "pdf")
+
+
+class APIError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def new_id() -> str:
+    return secrets.token_hex(12)
+
+
+def parse_time(value, now: Optional[float] = None) -> float:
+    """Convert an API date, such as "1 day" or an ISO date, to a timestamp."""
+    if value is None or value == "":
+        return time.time() if now is None else now
+    if isinstance(value, (int, float)):
+        return float(value)
+    relative = RELATIVE_DATE.match(str(value))
+    if relative:
+        amount, unit = relative.groups()
+        base = time.time() if now is None else now
+        return base - int(amount) * RELATIVE_UNITS[unit.lower()]
+    parsed = date_parser.parse(str(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def format_time(timestamp: float) -> str:
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+class Series:
+    """Records of a variable sorted by time, searched with bisect."""
+
+    def __init__(self) -> None:
+        self.times = []
+        self.records = []
+
+    def add(self, record: dict) -> None:
+        if not self.times or record["_time"] >= self.times[-1]:
+            self.times.append(record["_time"])
+            self.records.append(record)
+            return
+        position = bisect_right(self.times, record["_time"])
+        self.times.insert(position, record["_time"])
+        self.records.insert(position, record)
+
+    def between(self, start: float, end: float) -> list[dict]:
+        return self.records[
+            bisect_left(self.times, start) : bisect_right(self.times, end)
+        ]
+
+    def remove(self, ids: set[str]) -> None:
+        kept = [record for record in self.records if record["id"] not in ids]
+        self.records = kept
+        self.times = [record["_time"] for record in kept]
+
+
+class TokenBucket:
+    """Allow `rate` requests per second for each token, with bursts up to `rate`."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, token: str) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(token, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[token] = (tokens, now)
+                return False
+            self.buckets[token] = (tokens - 1, now)
+            return True
+
+
+class TagoIOEmulator:
+    """In-memory TagoIO API served on localhost.
+
+    Args:
+        latency (float): Seconds added to every response
+        jitter (float): Random seconds added on top of the latency
+        rate_limit (float): Requests per second allowed for each token, 0 for no limit
+        host (str): Interface of the server
+        port (int): Port of the server, 0 for any free port
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        rate_limit: float = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.host = host
+        self.port = port
+        self.lock = threading.RLock()
+
+        self.devices = {}
+        self.device_tokens = {}
+        self.series = defaultdict(lambda: defaultdict(Series))
+        self.params = defaultdict(list)
+        self.accounts = {}
+        self.profiles = {}
+        self.outbox = {service: [] for service in SERVICES}
+        self.prices = {
+            "plans": [{"name": "scale", "price": 90}],
+            "addons": [{"name": "mobile", "price": 25}],
+        }
+        self.stats = {}
+        self.reset_stats()
+
+        self.server = None
+        self.thread = None
+        self._previous_api = None
+
+    # Seeding
+
+    def add_account(self, token: Optional[str] = None, profiles: int = 1) -> str:
+        """Create an account with its profiles, and return its account token."""
+        token = token or str(uuid.uuid4())
+        with self.lock:
+            profile_ids = []
+            for position in range(profiles):
+                profile_id = new_id()
+                self.profiles[profile_id] = {
+                    "id": profile_id,
+                    "name": f"Profile {position + 1}",
+                    "tokens": [token] if position == 0 else [],
+                    "limit": {
+                        "input": 100000,
+                        "output": 100000,
+                        "data_records": 1000000,
+                    },
+                    "limit_used": {"input": 0, "output": 0, "data_records": 0},
+                }
+                profile_ids.append(profile_id)
+            self.accounts[token] = {
+                "id": new_id(),
+                "name": "Emulated account",
+                "email": "account@example.com",
+                "profiles": profile_ids,
+                "subscription": {
+                    "services": {
+                        "input": {"limit": 100000},
+                        "output": {"limit": 100000},
+                    }
+                },
+            }
+        return token
+
+    def add_device(
+        self, name: str, tags: Optional[list[dict]] = None, **fields
+    ) -> dict:
+        """Create a device and return it, with its token in "token"."""
+        device_id = new_id()
+        token = str(uuid.uuid4())
+        now = format_time(time.time())
+        device = {
+            "id": device_id,
+            "name": name,
+            "tags": tags or [],
+            "active": True,
+            "visible": True,
+            "type": "mutable",
+            "bucket": {"id": device_id, "name": name},
+            "profile": next(iter(self.profiles), None),
+            "created_at": now,
+            "updated_at": now,
+            "last_input": None,
+            "last_output": None,
+            **fields,
+        }
+        with self.lock:
+            self.devices[device_id] = device
+            self.device_tokens[token] = device_id
+        return {**device, "token": token}
+
+    def add_data(self, device_id: str, records) -> int:
+        """Add records to a device, as sendData does, and return how many."""
+        if isinstance(records, dict):
+            records = [records]
+        now = time.time()
+        count = 0
+        with self.lock:
+            series = self.series[device_id]
+            for item in records:
+                record_time = parse_time(item.get("time"), now)
+                record = {
+                    "id": new_id(),
+                    "device": device_id,
+                    "variable": item["variable"],
+                    "value": item.get("value"),
+                    "unit": item.get("unit"),
+                    "group": item.get("group") or new_id(),
+                    "location": item.get("location"),
+                    "metadata": item.get("metadata"),
+                    "time": format_time(record_time),
+                    "created_at": format_time(now),
+                    "_time": record_time,
+                }
+                series[item["variable"]].add(record)
+                count += 1
+            if count:
+                self.devices[device_id]["last_input"] = format_time(now)
+        return count
+
+    def token_of(self, device_id: str) -> str:
+        return next(
+            token for token, owner in self.device_tokens.items() if owner == device_id
+        )
+
+    def reset_stats(self) -> None:
+        """Clear the counters of calls, bytes and latency by endpoint."""
+        with self.lock:
+            self.stats = defaultdict(
+                lambda: {"calls": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+            )
+
+    def summary(self) -> dict:
+        """Calls, bytes and seconds by endpoint, and the totals."""
+        with self.lock:
+            endpoints = {key: dict(value) for key, value in self.stats.items()}
+        totals = {
+            field: sum(endpoint[field] for endpoint in endpoints.values())
+            for field in ("calls", "bytes_in", "bytes_out", "seconds")
+        }
+        return {"endpoints": endpoints, "totals": totals}
+
+    # Server
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.server.server_address[1]}"
+
+    def start(self) -> "TagoIOEmulator":
+        """Start the server and point the SDK at it through TAGOIO_API."""
+        emulator = self
+
+        class Handler(RequestHandler):
+            pass
+
+        Handler.emulator = emulator
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self._previous_api = os.environ.get("TAGOIO_API")
+        os.environ["TAGOIO_API"] = self.url
+        return self
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self._previous_api is None:
+            os.environ.pop("TAGOIO_API", None)
+        else:
+            os.environ["TAGOIO_API"] = self._previous_api
+
+    def __enter__(self) -> "TagoIOEmulator":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    # Authorization
+
+    def device_of(self, token: str) -> str:
+        device_id = self.device_tokens.get(token)
+        if not device_id:
+            raise APIError(401, "Authorization Denied: Invalid Device Token")
+        return device_id
+
+    def account_of(self, token: str) -> dict:
+        account = self.accounts.get(token)
+        if not account:
+            raise APIError(401, "Authorization Denied: Invalid Account Token")
+        return account
+
+    def account_device(self, token: str, device_id: str) -> str:
+        self.account_of(token)
+        if device_id not in self.devices:
+            raise APIError(404, "Device not found")
+        return device_id
+
+    # Data queries
+
+    def query_data(self, device_id: str, query: dict):
+        """Run a getData query, with the parameters of the API."""
+        series = self.series[device_id]
+        variables = query.get("variables") or query.get("variable")
+        if variables:
+            names = [variables] if isinstance(variables, str) else variables
+        else:
+            names = list(series)
+
+        start = parse_time(query["start_date"]) if query.get("start_date") else 0
+        end = parse_time(query["end_date"]) if query.get("end_date") else float("inf")
+        groups = set(query.get("groups") or ())
+        ids = set(query.get("ids") or ())
+
+        with self.lock:
+            selected = [
+                series[name].between(start, end) for name in names if name in series
+            ]
+        if groups or ids:
+            selected = [
+                [
+                    record
+                    for record in records
+                    if (not groups or record["group"] in groups)
+                    and (not ids or record["id"] in ids)
+                ]
+                for records in selected
+            ]
+        selected = [records for records in selected if records]
+
+        kind = query.get("query")
+        if kind in ("last_value", "first_value"):
+            position = -1 if kind == "last_value" else 0
+            return [records[position] for records in selected]
+        if kind in ("last_item", "first_item"):
+            candidates = [
+                records[-1 if kind == "last_item" else 0] for records in selected
+            ]
+            if not candidates:
+                return []
+            pick = max if kind == "last_item" else min
+            return [pick(candidates, key=lambda record: record["_time"])]
+        if kind in ("min", "max"):
+            pick = min if kind == "min" else max
+            return [
+                pick(numeric, key=lambda record: float(record["value"]))
+                for numeric in (
+                    [record for record in records if is_number(record["value"])]
+                    for records in selected
+                )
+                if numeric
+            ]
+        if kind in ("count", "sum", "avg"):
+            values = [
+                float(record["value"])
+                for records in selected
+                for record in records
+                if is_number(record["value"])
+            ]
+            if kind == "count":
+                return sum(len(records) for records in selected)
+            if kind == "sum":
+                return sum(values)
+            return sum(values) / len(values) if values else 0
+
+        descending = (query.get("ordination") or "descending") != "ascending"
+        iterators = [
+            reversed(records) if descending else records for records in selected
+        ]
+        merged = heapq.merge(
+            *iterators, key=lambda record: record["_time"], reverse=descending
+        )
+        skip = int(query.get("skip") or 0)
+        qty = min(int(query.get("qty") or DEFAULT_QTY), MAX_QTY)
+        return list(itertools.islice(merged, skip, skip + qty))
+
+    def delete_data(self, device_id: str, query: dict) -> str:
+        records = self.query_data(device_id, query)
+        if not isinstance(records, list):
+            raise APIError(400, "Invalid query to delete data")
+        by_variable = defaultdict(set)
+        for record in records:
+            by_variable[record["variable"]].add(record["id"])
+        with self.lock:
+            for variable, ids in by_variable.items():
+                self.series[device_id][variable].remove(ids)
+        return f"{len(records)} Data Removed"
+
+    def data_amount(self, device_id: str) -> int:
+        with self.lock:
+            return sum(
+                len(series.records) for series in self.series[device_id].values()
+            )
+
+    # Devices
+
+    def list_devices(self, query: dict) -> list[dict]:
+        filters = device_filters(query)
+        fields = query.get("fields") or ["id", "name"]
+        fields = [fields] if isinstance(fields, str) else fields
+        order_by = (query.get("orderBy") or "name,asc").replace(" ", "").split(",")
+        page = max(int(query.get("page") or 1), 1)
+        amount = min(int(query.get("amount") or 20), MAX_QTY)
+
+        with self.lock:
+            devices = [
+                device
+                for device in self.devices.values()
+                if device_matches(device, filters)
+            ]
+        devices.sort(
+            key=lambda device: str(device.get(order_by[0]) or ""),
+            reverse=len(order_by) > 1 and order_by[1] == "desc",
+        )
+        page_devices = devices[(page - 1) * amount : page * amount]
+        return [
+            {field: device.get(field) for field in fields} for device in page_devices
+        ]
+
+    def create_device(self, body: dict) -> dict:
+        fields = {
+            key: value for key, value in body.items() if key not in ("name", "tags")
+        }
+        device = self.add_device(
+            body.get("name") or "Device", body.get("tags"), **fields
+        )
+        return {
+            "device_id": device["id"],
+            "bucket_id": device["id"],
+            "token": device["token"],
+        }
+
+    def set_params(self, device_id: str, body) -> str:
+        items = body if isinstance(body, list) else [body]
+        with self.lock:
+            params = self.params[device_id]
+            for item in items:
+                existing = next(
+                    (
+                        param
+                        for param in params
+                        if param["id"] == item.get("id")
+                        or (not item.get("id") and param["key"] == item.get("key"))
+                    ),
+                    None,
+                )
+                if existing:
+                    existing.update(item)
+                else:
+                    params.append({"id": new_id(), "sent": False, **item})
+        return "Params Successfully Updated"
+
+    def list_params(self, device_id: str, query: dict) -> list[dict]:
+        with self.lock:
+            params = [dict(param) for param in self.params[device_id]]
+        sent_status = query.get("sent_status")
+        if sent_status is not None:
+            wanted = str(sent_status).lower() == "true"
+            params = [param for param in params if bool(param.get("sent")) == wanted]
+        return params
+
+    # Profiles and billing
+
+    def account_profiles(self, token: str) -> list[dict]:
+        account = self.account_of(token)
+        return [self.profiles[profile_id] for profile_id in account["profiles"]]
+
+    def profile(self, token: str, profile_id: str) -> dict:
+        if profile_id not in self.account_of(token)["profiles"]:
+            raise APIError(404, "Profile not found")
+        return self.profiles[profile_id]
+
+    # Requests
+
+    @staticmethod
+    def route(method: str, path: str):
+        """Find the endpoint of a request: its name, action and path parameters."""
+        for route_method, pattern, name, action in ROUTES:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                return name, action, match.groups()
+        return f"{method} {path}", None, ()
+
+    def record_call(self, endpoint: str, bytes_in: int, bytes_out: int, seconds: float):
+        with self.lock:
+            stats = self.stats[endpoint]
+            stats["calls"] += 1
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+            stats["seconds"] += seconds
+
+
+def is_number(value) -> bool:
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return not isinstance(value, bool)
+
+
+def device_filters(query: dict) -> dict:
+    """Read the filter[...] parameters of a device list, as the SDK sends them."""
+    filters = {"tags": defaultdict(dict)}
+    for key, value in query.items():
+        tag = re.match(r"^filter\[tags\]\[(\d+)\]\[(key|value)\]$", key)
+        if tag:
+            filters["tags"][int(tag.group(1))][tag.group(2)] = value
+            continue
+        field = re.match(r"^filter\[(\w+)\]$", key)
+        if field:
+            filters[field.group(1)] = value
+    filters["tags"] = list(filters["tags"].values())
+    return filters
+
+
+def device_matches(device: dict, filters: dict) -> bool:
+    for tag in filters["tags"]:
+        if not any(
+            item.get("key") == tag.get("key")
+            and ("value" not in tag or item.get("value") == tag["value"])
+            for item in device.get("tags") or []
+        ):
+            return False
+    for field, wanted in filters.items():
+        if field == "tags":
+            continue
+        value = str(device.get(field))
+        pattern = "^" + ".*".join(map(re.escape, str(wanted).split("*"))) + "$"
+        if not re.match(pattern, value):
+            return False
+    return True
+
+
+def public(records):
+    """Remove the internal fields of the records before they're returned."""
+    if not isinstance(records, list):
+        return records
+    return [
+        {key: value for key, value in record.items() if not key.startswith("_")}
+        for record in records
+    ]
+
+
+# Endpoints: each one receives (emulator, token, query, body, *path groups).
+
+
+def device_info(emulator, token, _query, _body):
+    return {**emulator.devices[emulator.device_of(token)]}
+
+
+def device_get_data(emulator, token, query, _body):
+    return public(emulator.query_data(emulator.device_of(token), query))
+
+
+def device_send_data(emulator, token, _query, body):
+    return f"{emulator.add_data(emulator.device_of(token), body)} Data Added"
+
+
+def device_delete_data(emulator, token, query, _body):
+    return emulator.delete_data(emulator.device_of(token), query)
+
+
+def device_get_params(emulator, token, query, _body):
+    return emulator.list_params(emulator.device_of(token), query)
+
+
+def account_info(emulator, token, _query, _body):
+    account = emulator.account_of(token)
+    return {key: account[key] for key in ("id", "name", "email")}
+
+
+def devices_list(emulator, token, query, _body):
+    emulator.account_of(token)
+    return emulator.list_devices(query)
+
+
+def devices_create(emulator, token, _query, body):
+    emulator.account_of(token)
+    return emulator.create_device(body or {})
+
+
+def devices_info(emulator, token, _query, _body, device_id):
+    return {**emulator.devices[emulator.account_device(token, device_id)]}
+
+
+def devices_token_list(emulator, token, _query, _body, device_id):
+    device_token = emulator.token_of(emulator.account_device(token, device_id))
+    return [
+        {
+            "name": "Default",
+            "token": device_token,
+            "permission": "full",
+            "created_at": None,
+            "last_authorization": None,
+        }
+    ]
+
+
+def devices_amount(emulator, token, _query, _body, device_id):
+    return emulator.data_amount(emulator.account_device(token, device_id))
+
+
+def devices_get_data(emulator, token, query, _body, device_id):
+    return public(emulator.query_data(emulator.account_device(token, device_id), query))
+
+
+def devices_send_data(emulator, token, _query, body, device_id):
+    count = emulator.add_data(emulator.account_device(token, device_id), body)
+    return f"{count} Data Added"
+
+
+def devices_delete_data(emulator, token, query, _body, device_id):
+    return emulator.delete_data(emulator.account_device(token, device_id), query)
+
+
+def devices_param_list(emulator, token, query, _body, device_id):
+    return emulator.list_params(emulator.account_device(token, device_id), query)
+
+
+def devices_param_set(emulator, token, _query, body, device_id):
+    return emulator.set_params(emulator.account_device(token, device_id), body)
+
+
+def profile_list(emulator, token, _query, _body):
+    return [
+        {"id": profile["id"], "name": profile["name"]}
+        for profile in emulator.account_profiles(token)
+    ]
+
+
+def profile_summary(emulator, token, _query, _body, profile_id):
+    profile = emulator.profile(token, profile_id)
+    return {"limit": profile["limit"], "limit_used": profile["limit_used"]}
+
+
+def profile_token_list(emulator, token, _query, _body, profile_id):
+    return [
+        {"name": "Token", "token": profile_token, "permission": "full"}
+        for profile_token in emulator.profile(token, profile_id)["tokens"]
+    ]
+
+
+def billing_prices(emulator, _token, _query, _body):
+    return emulator.prices
+
+
+def billing_subscription(emulator, token, _query, _body):
+    return emulator.account_of(token)["subscription"]
+
+
+def billing_edit_subscription(emulator, token, _query, body):
+    services = emulator.account_of(token)["subscription"]["services"]
+    services.update((body or {}).get("services", {}))
+    return "Subscription updated"
+
+
+def billing_edit_allocation(emulator, token, _query, _body):
+    emulator.account_of(token)
+    return "Allocation updated"
+
+
+def send_service(service: str, message: str):
+    def send(emulator, token, _query, body):
+        with emulator.lock:
+            emulator.outbox[service].append({"token": token, **(body or {})})
+        return message
+
+    return send
+
+
+def generate_pdf(emulator, token, _query, body):
+    body = body or {}
+    with emulator.lock:
+        emulator.outbox["pdf"].append({"token": token, **body})
+    source = body.get("base64") or body.get("html") or ""
+    pdf = b"%PDF-1.4\n% emulated\n" + f"source bytes: {len(source)}\n".encode()
+    return base64.b64encode(pdf).decode("ascii")
+
+
+ROUTES = [
+    (method, re.compile(f"^{pattern}$"), name, action)
+    for method, pattern, name, action in [
+        # Device token
+        ("GET", r"/info", "device.info", device_info),
+        ("GET", r"/data", "device.getData", device_get_data),
+        ("POST", r"/data", "device.sendData", device_send_data),
+        ("DELETE", r"/data", "device.deleteData", device_delete_data),
+        ("GET", r"/device/params", "device.getParameters", device_get_params),
+        # Account token
+        ("GET", r"/account", "account.info", account_info),
+        ("GET", r"/device", "devices.list", devices_list),
+        ("POST", r"/device", "devices.create", devices_create),
+        ("GET", r"/device/token/(\w+)", "devices.tokenList", devices_token_list),
+        ("GET", r"/device/(\w+)/data_amount", "devices.amount", devices_amount),
+        ("GET", r"/device/(\w+)/data", "devices.getDeviceData", devices_get_data),
+        ("POST", r"/device/(\w+)/data", "devices.sendDeviceData", devices_send_data),
+        (
+            "DELETE",
+            r"/device/(\w+)/data",
+            "devices.deleteDeviceData",
+            devices_delete_data,
+        ),
+        ("GET", r"/device/(\w+)/params", "devices.paramList", devices_param_list),
+        ("POST", r"/device/(\w+)/params", "devices.paramSet", devices_param_set),
+        ("GET", r"/device/(\w+)", "devices.info", devices_info),
+        ("GET", r"/profile", "profile.list", profile_list),
+        ("GET", r"/profile/(\w+)/summary", "profile.summary", profile_summary),
+        ("GET", r"/profile/(\w+)/token", "profile.tokenList", profile_token_list),
+        ("GET", r"/pricing", "billing.getPrices", billing_prices),
+        (
+            "GET",
+            r"/account/subscription",
+            "billing.getSubscription",
+            billing_subscription,
+        ),
+        (
+            "POST",
+            r"/account/subscription",
+            "billing.editSubscription",
+            billing_edit_subscription,
+        ),
+        (
+            "POST",
+            r"/account/allocation",
+            "billing.editAllocation",
+            billing_edit_allocation,
+        ),
+        # Services, with the analysis token
+        (
+            "POST",
+            r"/analysis/services/email/send",
+            "services.email",
+            send_service("email", "Email queued"),
+        ),
+        (
+            "POST",
+            r"/analysis/services/sms/send",
+            "services.sms",
+            send_service("sms", "SMS queued"),
+        ),
+        (
+            "POST",
+            r"/analysis/services/mqtt/publish",
+            "services.mqtt",
+            send_service("mqtt", "MQTT message published"),
+        ),
+        (
+            "POST",
+            r"/analysis/services/notification/send",
+            "services.notification",
+            send_service("notification", "Notification sent"),
+        ),
+        (
+            "POST",
+            r"/analysis/services/console/send",
+            "services.console",
+            send_service("console", "Console sent"),
+        ),
+        (
+            "POST",
+            r"/analysis/services/attachment/upload",
+            "services.attachment",
+            send_service("attachment", "Attachment uploaded"),
+        ),
+        ("POST", r"/pdf", "services.pdf", generate_pdf),
+    ]
+]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Answer the requests of the SDK with the {"status", "result"} envelope."""
+
+    emulator: TagoIOEmulator = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _handle(self) -> None:
+        start = time.perf_counter()
+        emulator = self.emulator
+        url = urlsplit(self.path)
+        query = {}
+        for key, values in parse_qs(url.query, keep_blank_values=True).items():
+            key = key.removesuffix("[]")
+            query[key] = values if key in LIST_PARAMS else values[-1]
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        token = self.headers.get("token") or ""
+        endpoint, action, arguments = emulator.route(
+            self.command, url.path.rstrip("/") or "/"
+        )
+
+        try:
+            if action is None:
+                raise APIError(404, f"Route not emulated: {endpoint}")
+            if emulator.limiter and not emulator.limiter.allow(token):
+                raise APIError(429, "Too many requests")
+            body = json.loads(raw_body) if raw_body else None
+            result = action(emulator, token, query, body, *arguments)
+            status, payload = 200, {"status": True, "result": result}
+        except APIError as error:
+            status, payload = error.status, {"status": False, "message": error.message}
+        except (ValueError, KeyError, TypeError) as error:
+            status, payload = 400, {"status": False, "message": str(error)}
+
+        delay = emulator.latency + random.uniform(0, emulator.jitter)
+        if delay:
+            time.sleep(delay)
+
+        response = json.dumps(payload, default=str).encode()
+        # Recorded before the response is written, so a summary read as soon as the
+        # client gets the response already counts this call.
+        emulator.record_call(
+            endpoint, len(raw_body), len(response), time.perf_counter() - start
+        )
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def seed(emulator: TagoIOEmulator, devices: int, records: int) -> str:
+    """Create an account with devices and data, and return the account token."""
+    account_token = emulator.add_account()
+    now = time.time()
+    for position in range(devices):
+        device = emulator.add_device(
+            f"Device {position + 1:05d}",
+            tags=[{"key": "type", "value": "sensor"}],
+        )
+        emulator.add_data(
+            device["id"],
+            [
+                {
+                    "variable": "temperature",
+                    "value": round(random.uniform(15, 30), 2),
+                    "unit": "C",
+                    "time": now - minute * 60,
+                }
+                for minute in range(records)
+            ],
+        )
+    return account_token
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0)
+    args = parser.parse_args()
+
+    emulator = TagoIOEmulator(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        port=args.port,
+    )
+    account_token = seed(emulator, args.devices, args.records)
+    emulator.start()
+    print(f"TagoIO emulator at {emulator.url}")
+    print(f"export TAGOIO_API={emulator.url}")
+    print(f"account_token: {account_token}")
+    for device_id in itertools.islice(emulator.devices, 3):
+        print(f"device_token: {emulator.token_of(device_id)}")
+    try:
+        emulator.thread.join()
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Tests of the http-fan-out snippet against a local HTTP stub server.
+
+Usage:
+    python -m unittest discover -s scripts/analysis -p "test_*.py"
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from snippet_loader import load_snippet
+
+fan_out = load_snippet("http-fan-out")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers /ok, /slow/<seconds>, /flaky/<failures>/<key> and 404 otherwise."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        parts = self.path.split("?")[0].strip("/").split("/")
+        status = 200
+        if parts[0] not in ("ok", "slow", "flaky"):
+            status = 404
+        elif parts[0] == "slow":
+            time.sleep(float(parts[1]))
+        elif parts[0] == "flaky":
+            with self.server.lock:
+                self.server.hits[self.path] += 1
+                if self.server.hits[self.path] <= int(parts[1]):
+                    status = 503
+
+        body = self.path.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class FanOutTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.server.hits = Counter()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def fetch_all(self, urls: list[str], **options) -> list[dict]:
+        async def collect() -> list[dict]:
+            return [result async for result in fan_out.fetch_all(urls, **options)]
+
+        return asyncio.run(collect())
+
+    def test_every_url_is_requested(self) -> None:
+        urls = [f"{self.base}/ok?index={index}" for index in range(20)]
+        results = self.fetch_all(urls)
+
+        self.assertEqual(sorted(result["url"] for result in results), sorted(urls))
+        self.assertTrue(all(result["status"] == 200 for result in results))
+        self.assertTrue(all("error" not in result for result in results))
+
+    def test_results_arrive_as_they_complete(self) -> None:
+        urls = [f"{self.base}/slow/0.4", f"{self.base}/ok"]
+        results = self.fetch_all(urls)
+
+        self.assertEqual([result["url"] for result in results], urls[::-1])
+
+    def test_retry_status_is_retried(self) -> None:
+        url = f"{self.base}/flaky/2/retry"
+        (result,) = self.fetch_all([url], max_attempts=3)
+
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(result["attempts"], 3)
+        self.assertNotIn("error", result)
+
+    def test_retry_stops_after_max_attempts(self) -> None:
+        url = f"{self.base}/flaky/5/give-up"
+        (result,) = self.fetch_all([url], max_attempts=2)
+
+        self.assertEqual(result["status"], 503)
+        self.assertEqual(result["attempts"], 2)
+        self.assertEqual(result["error"], "HTTP 503")
+
+    def test_error_status_is_a_failure_without_retry(self) -> None:
+        (result,) = self.fetch_all([f"{self.base}/missing"], max_attempts=3)
+
+        self.assertEqual(result["status"], 404)
+        self.assertEqual(result["attempts"], 1)
+        self.assertEqual(result["error"], "HTTP 404")
+
+    def test_slow_response_times_out(self) -> None:
+        (result,) = self.fetch_all([f"{self.base}/slow/1"], timeout=0.2, max_attempts=1)
+
+        self.assertIn("error", result)
+        self.assertNotIn("body", result)
+
+    def test_waiting_for_a_connection_does_not_time_out(self) -> None:
+        # One connection to the host: the last request waits about 0.9 seconds for it,
+        # longer than the timeout, but each response takes less than the timeout.
+        urls = [f"{self.base}/slow/0.3?index={index}" for index in range(4)]
+        results = self.fetch_all(urls, max_per_host=1, timeout=0.6, max_attempts=1)
+
+        self.assertTrue(all(result.get("status") == 200 for result in results))
+        self.assertTrue(all("error" not in result for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,6 +25,8 @@ In the action you set how often you want to run this script to check your limits
 Environment Variables
 In order to use this analysis, you must setup the Environment Variable table.
 account_token: Your account token. Check the steps at the end to understand how to generate it.
+account_tokens: Tokens of several accounts to check in the same run, comma separated (OPTIONAL, replaces account_token).
+max_workers: Accounts checked at the same time with account_tokens (OPTIONAL, default: 5).
 input: 95. The 95 value will scale data input when it reachs 95% of the usage. Keep it blank to not scale data input.
 output: 95
 data_records: 95
@@ -33,6 +35,34 @@ sms: 95
 email: 95
 push_notification: 95
 file_storage: 95
+profile_index_file: File of the token to profile index (OPTIONAL, default: a file in the temp directory).
+prices_cache_hours: Hours the billing tiers are cached, 0 to not cache (OPTIONAL, default: 6).
+schedule_minutes: How often the action runs this analysis (OPTIONAL, default: the time since the last run).
+trend_alpha: Weight of the newest usage rate in the trend, from 0 to 1 (OPTIONAL, default: 0.3).
+history_device_id: Device whose configuration parameters keep the usage history (OPTIONAL, default: a file in the temp directory).
+
+The profile of the account token is kept in a token to profile index on disk, so the
+scheduled runs don't list the tokens of every profile to find it. The index only stores
+a hash of each token, and it's rebuilt when a token is not found, fetching the token lists
+of all the profiles at the same time.
+
+The subscription, the profile summary, the billing tiers and the profile list are
+requested at the same time, and the billing tiers are cached on disk for a few hours,
+since they rarely change. The tiers of each service are sorted once, so the next tier
+above the current limit is found with a binary search.
+
+Besides the percentage of each service, the analysis keeps the usage of the last runs
+and follows its trend with an exponentially weighted average of the usage rate. When the
+trend reaches the limit before the next run, the service is scaled right away, so bursts
+don't exhaust the limit between two runs. The trend needs the usage of the previous runs:
+by default it's kept in a file in the temp directory, which only works when the runs of
+the analysis share that folder. Otherwise set history_device_id, and the usage is kept in
+a configuration parameter of that device. While the history has a single run, the
+analysis prints a note and scales by the percentage only.
+
+With account_tokens, a single analysis checks every account, a few at the same time, with
+the same settings and a single copy of the billing tiers, and prints a summary of each
+account at the end.
 
 Steps to generate an account_token:
 1 - Enter the following link: https://admin.tago.io/account/
@@ -42,8 +72,17 @@ Steps to generate an account_token:
 5 - Press the Copy Button and place at the Environment Variables tab of this analysis.
 """
 
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import Optional
+from typing import Callable, Optional
 
 from tagoio_sdk import Account, Analysis
 from tagoio_sdk.modules.Utils.envToJson import envToJson
@@ -53,75 +92,349 @@ from tagoio_sdk.modules.Account.Billing_Type import (
 )
 
 
+class BillingTiers:
+    """Tiers of every service sorted by amount, to find the next tier with bisect.
+
+    Args:
+        billing (BillingPrices): Result of account.billing.getPrices()
+    """
+
+    def __init__(self, billing: BillingPrices) -> None:
+        self.amounts = {}
+        for service, tiers in billing.items():
+            if not isinstance(tiers, list) or not all("amount" in t for t in tiers):
+                continue
+            self.amounts[service] = array("d", sorted(t["amount"] for t in tiers))
+
+    def next_amount(self, service: str, limit: float) -> Optional[float]:
+        """Amount of the first tier of the service above the limit, if any."""
+        amounts = self.amounts.get(service)
+        if not amounts:
+            return None
+        position = bisect_right(amounts, limit)
+        if position == len(amounts):
+            return None
+        amount = amounts[position]
+        return int(amount) if amount.is_integer() else amount
+
+
 @dataclass
 class CheckAutoScaleSource:
     type: str
     current_value: int
     limit: int
     scale: float
-    billing: BillingPrices
+    billing: BillingTiers
     account_limit: BillingSubscriptionServices
+    time_to_limit: Optional[float] = None
+    horizon: float = 0
 
 
 def check_auto_scale(data: CheckAutoScaleSource) -> Optional[int]:
-    # Stop if current use is less than 95% of what was hired.
-    if data.limit <= 0 or data.limit * (data.scale * 0.01) > data.current_value:
+    # Stop if current use is less than 95% of what was hired, unless the usage trend
+    # reaches the limit before the next run.
+    reached = data.limit * (data.scale * 0.01) <= data.current_value
+    projected = data.time_to_limit is not None and data.time_to_limit < data.horizon
+    if data.limit <= 0 or not (reached or projected):
         return None
 
-    service_billing = next(
-        (
-            obj
-            for obj in data.billing[data.type]
-            if obj["amount"] > data.account_limit[data.type]["limit"]
-        ),
-        None,
-    )
-    return service_billing["amount"] if service_billing else None
+    return data.billing.next_amount(data.type, data.account_limit[data.type]["limit"])
 
 
-def get_profile_id_by_token(account: Account, token: str) -> Optional[str]:
-    profiles = account.profile.list()
+PROFILE_INDEX_FILE = os.path.join(tempfile.gettempdir(), "tagoio-profile-index.json")
+PRICES_CACHE_FILE = os.path.join(tempfile.gettempdir(), "tagoio-billing-prices.json")
+USAGE_HISTORY_FILE = os.path.join(tempfile.gettempdir(), "tagoio-usage-{profile}.json")
+USAGE_HISTORY_SIZE = 30
+TOKEN_PAGE_SIZE = 1000
+# The accounts of a sweep update the same profile index from several threads.
+PROFILE_INDEX_LOCK = threading.Lock()
 
-    for profile in profiles:
-        token_exist = [
-            obj
-            for obj in account.profile.tokenList(profileID=profile["id"])
-            if obj["token"] == token
-        ]
-        if token_exist:
-            return profile["id"]
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def load_json_file(path: str) -> dict:
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_json_file(path: str, content) -> None:
+    # Write to a temporary file first, so a run never reads a partial file. Each write
+    # has its own temporary file, so threads saving the same file don't collide.
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=f"{name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(descriptor, "w") as json_file:
+            json.dump(content, json_file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def list_profile_tokens(account: Account, profile_id: str) -> list[str]:
+    tokens = []
+    page = 1
+    while True:
+        result = account.profile.tokenList(
+            profileID=profile_id,
+            queryObj={"page": page, "amount": TOKEN_PAGE_SIZE, "fields": ["token"]},
+        )
+        tokens.extend(obj["token"] for obj in result)
+        if len(result) < TOKEN_PAGE_SIZE:
+            return tokens
+        page += 1
+
+
+def build_profile_index(
+    account: Account, profiles: Optional[list] = None, max_workers: int = 10
+) -> dict[str, str]:
+    """Fetch the token lists of all the profiles at the same time.
+
+    Args:
+        account (Account): Account of the profiles
+        profiles (list): Profiles already listed (OPTIONAL, listed when missing)
+        max_workers (int): Profiles fetched at the same time
+
+    Returns:
+        dict[str, str]: Profile ID by token hash
+    """
+    if profiles is None:
+        profiles = account.profile.list()
+    profile_ids = [profile["id"] for profile in profiles]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        token_lists = executor.map(
+            lambda profile_id: list_profile_tokens(account, profile_id), profile_ids
+        )
+        return {
+            hash_token(token): profile_id
+            for profile_id, tokens in zip(profile_ids, token_lists)
+            for token in tokens
+        }
+
+
+def get_profile_id_by_token(
+    account: Account,
+    token: str,
+    index_file: str = PROFILE_INDEX_FILE,
+    list_profiles: Optional[Callable[[], list]] = None,
+) -> Optional[str]:
+    key = hash_token(token)
+    index = load_json_file(index_file)
+    if key in index:
+        return index[key]
+
+    # The token is new or the index is missing, so rebuild it from the account. The
+    # accounts of a sweep rebuild at the same time, and only the merge is locked, so the
+    # entries of another account saved in the meantime are kept.
+    profiles = list_profiles() if list_profiles else None
+    rebuilt = build_profile_index(account, profiles=profiles)
+    with PROFILE_INDEX_LOCK:
+        index = load_json_file(index_file)
+        index.update(rebuilt)
+        save_json_file(index_file, index)
+    if key in index:
+        return index[key]
     raise Exception(
         "Profile not found for the account token in the environment variable"
     )
 
 
-def my_analysis(context, list: list = None):
-    # Get the environment variables and parses it to a JSON
-    environment = envToJson(environment=context.environment)
+def get_prices(
+    account: Account, cache_file: str = PRICES_CACHE_FILE, max_age_hours: float = 6
+) -> BillingPrices:
+    """Get the billing tiers, from the cache file while it's newer than max_age_hours."""
+    try:
+        if time.time() - os.path.getmtime(cache_file) < max_age_hours * 3600:
+            with open(cache_file) as prices_file:
+                return json.load(prices_file)
+    except (OSError, ValueError):
+        pass
+
+    prices = account.billing.getPrices()
+    if max_age_hours > 0:
+        save_json_file(cache_file, prices)
+    return prices
+
+
+class UsageHistory:
+    """Usage of the services of a profile in the last runs, to follow its trend.
+
+    Args:
+        path (str): File of the history
+        size (int): Samples kept for each service
+    """
+
+    def __init__(self, path: str, size: int = USAGE_HISTORY_SIZE) -> None:
+        self.path = path
+        self.size = size
+        self.samples = load_json_file(path)
+
+    def record(self, service: str, timestamp: float, used: float) -> None:
+        samples = self.samples.setdefault(service, [])
+        # The usage restarts with the billing cycle, so the older samples don't apply.
+        if samples and used < samples[-1][1]:
+            samples.clear()
+        samples.append([timestamp, used])
+        del samples[: -self.size]
+
+    def rate(self, service: str, alpha: float) -> float:
+        """Exponentially weighted average of the usage per second between samples."""
+        samples = self.samples.get(service) or []
+        rate = None
+        for (start, start_used), (end, end_used) in zip(samples, samples[1:]):
+            if end <= start:
+                continue
+            current = (end_used - start_used) / (end - start)
+            rate = current if rate is None else alpha * current + (1 - alpha) * rate
+        return rate or 0.0
+
+    def time_to_limit(
+        self, service: str, limit: float, alpha: float
+    ) -> Optional[float]:
+        """Seconds until the trend of the service reaches the limit, if it's growing."""
+        rate = self.rate(service, alpha)
+        if rate <= 0:
+            return None
+        return max(limit - self.samples[service][-1][1], 0) / rate
+
+    def last_interval(self) -> Optional[float]:
+        """Seconds between the two last samples, the interval of the schedule."""
+        intervals = [
+            samples[-1][0] - samples[-2][0]
+            for samples in self.samples.values()
+            if len(samples) > 1
+        ]
+        return max(intervals) if intervals else None
+
+    def save(self) -> None:
+        save_json_file(self.path, self.samples)
+
+    def has_trend(self) -> bool:
+        """Whether any service has the two samples needed to follow its trend."""
+        return any(len(samples) > 1 for samples in self.samples.values())
+
+
+class DeviceUsageHistory(UsageHistory):
+    """Usage history kept in a configuration parameter of a device, for the runtimes that
+    don't keep the temp directory between runs.
+
+    Args:
+        account (Account): Account of the device
+        device_id (str): Device that keeps the history
+        profile_id (str): Profile of the history, part of the parameter key
+        size (int): Samples kept for each service
+    """
+
+    def __init__(
+        self,
+        account: Account,
+        device_id: str,
+        profile_id: str,
+        size: int = USAGE_HISTORY_SIZE,
+    ) -> None:
+        self.account = account
+        self.device_id = device_id
+        self.key = f"usage_history_{profile_id}"
+        self.size = size
+        params = account.devices.paramList(deviceID=device_id)
+        param = next((param for param in params if param["key"] == self.key), None)
+        self.param_id = param["id"] if param else None
+        try:
+            self.samples = json.loads(param["value"]) if param else {}
+        except ValueError:
+            self.samples = {}
+
+    def save(self) -> None:
+        self.account.devices.paramSet(
+            deviceID=self.device_id,
+            configObj={
+                "id": self.param_id,
+                "key": self.key,
+                "value": json.dumps(self.samples, separators=(",", ":")),
+                "sent": False,
+            },
+        )
 
-    if not environment:
-        raise ValueError("[ERROR] environment variable empty.")
 
-    if not environment.get("account_token"):
-        raise ValueError(
-            "[ERROR] You must enter a valid account_token in the environment variable"
+def autoscale_account(
+    account_token: str,
+    environment: dict,
+    billing_tiers: Optional[BillingTiers] = None,
+    label: str = "",
+):
+    """Check the usage of the profile of an account token and scale it if needed.
+
+    Args:
+        account_token (str): Token of the account and profile to check
+        environment (dict): Environment variables with the settings of the services
+        billing_tiers (BillingTiers): Tiers shared by several accounts (OPTIONAL)
+        label (str): Prefix of the messages of this account (OPTIONAL)
+
+    Returns:
+        "scaled", "okay" when no service needs scaling, "not scaled" when the
+        subscription was not changed, or the error of the account
+    """
+    account = Account({"token": account_token})
+    prices_cache_hours = float(environment.get("prices_cache_hours") or 6)
+
+    # The requests don't depend on each other, so they are made at the same time.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        profiles_future = executor.submit(account.profile.list)
+        # Get the current subscriptions of our account for all the services.
+        subscription_future = executor.submit(account.billing.getSubscription)
+        # get the tiers of all services, so we know the next tier for our limits.
+        if billing_tiers is None:
+            prices_future = executor.submit(
+                get_prices, account, PRICES_CACHE_FILE, prices_cache_hours
+            )
+
+        # Get's the ID of the profile the account token belongs to.
+        profile_id = get_profile_id_by_token(
+            account=account,
+            token=account_token,
+            index_file=environment.get("profile_index_file") or PROFILE_INDEX_FILE,
+            list_profiles=profiles_future.result,
         )
 
-    # Setup the account and get's the ID of the profile the account token belongs to.
-    account = Account({"token": environment["account_token"]})
-    profile_id = get_profile_id_by_token(
-        account=account, token=environment["account_token"]
-    )
+        # get current limit and used resources of the profile.
+        summary = account.profile.summary(profileID=profile_id)
+        limit, limit_used = summary["limit"], summary["limit_used"]
 
-    # Get the current subscriptions of our account for all the services.
-    services_limit = (account.billing.getSubscription())["services"]
+        services_limit = subscription_future.result()["services"]
+        if billing_tiers is None:
+            billing_tiers = BillingTiers(prices_future.result())
+        profiles = profiles_future.result()
 
-    # get current limit and used resources of the profile.
-    summary = account.profile.summary(profileID=profile_id)
-    limit, limit_used = summary["limit"], summary["limit_used"]
+    # Keep the usage of this run, to follow the trend of each service.
+    if environment.get("history_device_id"):
+        history = DeviceUsageHistory(
+            account, environment["history_device_id"], profile_id
+        )
+    else:
+        history = UsageHistory(USAGE_HISTORY_FILE.format(profile=profile_id))
+    now = time.time()
+    for statistic_key, used in limit_used.items():
+        history.record(statistic_key, now, used)
+    history.save()
+    if not history.has_trend():
+        print(
+            f"{label}The usage history has a single run, so the trend is not used yet. "
+            "If this note shows on every run, the history is not kept between runs: "
+            "set history_device_id."
+        )
 
-    # get the tiers of all services, so we know the next tier for our limits.
-    billing_prices = account.billing.getPrices()
+    trend_alpha = float(environment.get("trend_alpha") or 0.3)
+    if environment.get("schedule_minutes"):
+        horizon = float(environment["schedule_minutes"]) * 60
+    else:
+        horizon = history.last_interval() or 0
 
     # Check each service to see if it needs scaling
     auto_scale_services = {}
@@ -131,7 +444,7 @@ def my_analysis(context, list: list = None):
 
         if not environment[statistic_key].isnumeric():
             print(
-                f"[ERROR] Ignoring {statistic_key}, because the environment variable value is not a number."
+                f"{label}[ERROR] Ignoring {statistic_key}, because the environment variable value is not a number."
             )
             continue
 
@@ -144,33 +457,42 @@ def my_analysis(context, list: list = None):
             current_value=limit_used[statistic_key],
             limit=limit[statistic_key],
             scale=scale,
-            billing=billing_prices,
+            billing=billing_tiers,
             account_limit=services_limit,
+            time_to_limit=history.time_to_limit(
+                statistic_key, limit[statistic_key], trend_alpha
+            ),
+            horizon=horizon,
         )
         result = check_auto_scale(data=data)
         if result:
             auto_scale_services[statistic_key] = {"limit": result}
+            if data.time_to_limit is not None and data.time_to_limit < horizon:
+                print(
+                    f"{label}{statistic_key} is projected to reach its limit in "
+                    f"{data.time_to_limit:.0f}s, before the next run."
+                )
 
     # Stop if no auto-scale needed
     if not auto_scale_services:
-        print("Services are okay, no auto-scaling needed.")
-        return "Services are okay, no auto-scaling needed."
+        print(f"{label}Services are okay, no auto-scaling needed.")
+        return "okay"
 
-    print(f"Auto-scaling the services: {', '.join(auto_scale_services.keys())}")
+    print(f"{label}Auto-scaling the services: {', '.join(auto_scale_services.keys())}")
     # Update our subscription, so we are actually scaling the account.
     try:
         billing_success = account.billing.editSubscription(
             subscription={"services": auto_scale_services}
         )
     except Exception as error:
-        print(f"[ERROR] {error}")
+        print(f"{label}[ERROR] {error}")
         return error
 
     if not billing_success:
-        return
+        return "not scaled"
+    print(f"{label}{billing_success}")
 
     # Stop here if account has only one profile. No need to reallocate resources
-    profiles = account.profile.list()
     if len(profiles) > 1:
         # Make sure we realocate only what we just subscribed
         amount_to_relocate = {}
@@ -188,10 +510,80 @@ def my_analysis(context, list: list = None):
                 }
             )
         except Exception as error:
-            print(f"[ERROR] {error}")
+            print(f"{label}[ERROR] {error}")
             return error
 
-    return billing_success
+    return "scaled"
+
+
+def sweep_accounts(account_tokens: list[str], environment: dict) -> dict[str, str]:
+    """Autoscale several accounts at the same time, sharing the billing tiers.
+
+    Args:
+        account_tokens (list[str]): Tokens of the accounts
+        environment (dict): Environment variables with the settings of the services
+
+    Returns:
+        dict[str, str]: Summary of each account, by its label
+    """
+    prices_cache_hours = float(environment.get("prices_cache_hours") or 6)
+    first_account = Account({"token": account_tokens[0]})
+    billing_tiers = BillingTiers(
+        get_prices(first_account, PRICES_CACHE_FILE, prices_cache_hours)
+    )
+
+    # The tokens are never printed, each account is labeled by a hash of its token.
+    labels = [
+        f"account {position} ({hash_token(token)[:8]})"
+        for position, token in enumerate(account_tokens, start=1)
+    ]
+
+    summary = {}
+    max_workers = int(environment.get("max_workers") or 5)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                autoscale_account, token, environment, billing_tiers, f"[{label}] "
+            ): label
+            for token, label in zip(account_tokens, labels)
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                result = error
+
+            if isinstance(result, Exception):
+                summary[futures[future]] = f"failed: {result}"
+            else:
+                summary[futures[future]] = result
+
+    for label in labels:
+        print(f"{label}: {summary[label]}")
+    return summary
+
+
+def my_analysis(context, list: list = None):
+    # Get the environment variables and parses it to a JSON
+    environment = envToJson(environment=context.environment)
+
+    if not environment:
+        raise ValueError("[ERROR] environment variable empty.")
+
+    account_tokens = [
+        token.strip()
+        for token in (environment.get("account_tokens") or "").split(",")
+        if token.strip()
+    ]
+    if account_tokens:
+        return sweep_accounts(account_tokens, environment)
+
+    if not environment.get("account_token"):
+        raise ValueError(
+            "[ERROR] You must enter a valid account_token in the environment variable"
+        )
+
+    return autoscale_account(environment["account_token"], environment)
 
 
 # The analysis token in only necessary to run the analysis outside TagoIO
@@ -0,0 +1,324 @@
+# @title: Derived Variables
+# @description: Calculate many new variables from formulas with a single read and a single write
+# @tags: data, formula, calculation, derived, operations, numpy
+
+# /// script
+# dependencies = [
+#   "tagoio-sdk",
+#   "numpy"
+# ]
+# ///
+
+"""
+Analysis Example
+Derived variables
+
+Calculate new variables from formulas of the device variables, such as the dew point from
+the temperature and the humidity, and store them in the device.
+
+Each formula has the form "output = expression", one per line. The expressions can use
+the device variables, the variables calculated by the formulas above them, numbers,
++ - * / ** %, comparisons and the functions sqrt, exp, log, log10, abs, round, min, max
+and where(condition, value_if_true, value_if_false). Formulas whose output starts with _
+are only used by the formulas below them, and are not stored.
+
+The formulas are parsed and compiled once. All the variables used by the formulas are read
+with a single getData, each formula is calculated for all the records at once with numpy,
+and all the new variables are sent with a single sendData, no matter how many formulas.
+Records are matched by their group, or by their time when they don't have a group.
+
+With start_date, the records in the window are calculated again on each run, so only the
+rows newer than the last stored value of each output are sent, and the runs don't store
+the same values twice.
+
+When an action triggers this analysis, the last values of the device come from the scope,
+and only the variables that are not in the scope are read from the device. If the scope
+has all of them, nothing is read. The records of other devices in the scope are ignored.
+The id of the device, needed to find its records, is read once and kept for the next runs,
+or taken from the device_id environment variable.
+
+Instructions
+To run this analysis you need to add a device token to the environment variables,
+To do that, go to your device, then token and copy your token.
+Go the the analysis, then environment variables,
+type device_token on key, and paste your token on value
+
+Environment Variables
+device_token: Token of the device with the variables.
+device_id: Id of the device, so it's never requested (OPTIONAL).
+formulas: Formulas to calculate, one per line (OPTIONAL, default: the FORMULAS below).
+start_date: Calculate the records since this date, such as "1 day", instead of the last values (OPTIONAL).
+"""
+
+import ast
+from functools import lru_cache
+from itertools import compress
+
+import numpy as np
+from tagoio_sdk import Analysis, Device
+from tagoio_sdk.modules.Utils.dateParser import dateParserList
+from tagoio_sdk.modules.Utils.envToJson import envToJson
+
+FORMULAS = """
+temperature_double = temperature * 2
+temperature_fahrenheit = temperature * 9 / 5 + 32
+_gamma = log(humidity / 100) + 17.625 * temperature / (243.04 + temperature)
+dew_point = 243.04 * _gamma / (17.625 - _gamma)
+"""
+
+# Records read when start_date is used.
+MAX_RECORDS = 10000
+
+# Device id by device token, kept between runs so the id is only requested once.
+DEVICE_IDS: dict[str, str] = {}
+
+FUNCTIONS = {
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "abs": np.abs,
+    "round": np.round,
+    "min": np.minimum,
+    "max": np.maximum,
+    "where": np.where,
+}
+
+ALLOWED_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Compare,
+    ast.Call,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+)
+
+
+class Formula:
+    """A formula parsed and compiled to calculate arrays of values.
+
+    Args:
+        line (str): Formula in the form "output = expression"
+    """
+
+    def __init__(self, line: str) -> None:
+        output, separator, expression = line.partition("=")
+        self.output = output.strip()
+        if not separator or not self.output.isidentifier():
+            raise ValueError(f"Invalid formula '{line}', use 'output = expression'")
+
+        tree = ast.parse(expression.strip(), mode="eval")
+        self.inputs = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError(f"Invalid formula '{line}': {type(node).__name__}")
+            if isinstance(node, ast.Call) and (
+                not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS
+            ):
+                raise ValueError(f"Invalid formula '{line}': unknown function")
+            if isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+                self.inputs.add(node.id)
+
+        self.code = compile(tree, f"<{self.output}>", "eval")
+
+    def evaluate(self, columns: dict[str, np.ndarray]) -> np.ndarray:
+        return eval(self.code, {"__builtins__": {}, **FUNCTIONS}, columns)
+
+
+@lru_cache(maxsize=8)
+def compile_formulas(text: str) -> tuple[list[Formula], list[str]]:
+    """Compile the formulas and find the device variables they read.
+
+    Args:
+        text (str): Formulas, one per line
+
+    Returns:
+        tuple[list[Formula], list[str]]: The formulas and the variables to read
+    """
+    formulas = [Formula(line) for line in text.splitlines() if line.strip()]
+
+    variables = []
+    calculated = set()
+    for formula in formulas:
+        for name in sorted(formula.inputs - calculated):
+            if name not in variables:
+                variables.append(name)
+        calculated.add(formula.output)
+    return formulas, variables
+
+
+def get_device_id(device: Device, device_token: str) -> str:
+    """Id of the device of the token, requested only on the first run."""
+    if device_token not in DEVICE_IDS:
+        DEVICE_IDS[device_token] = device.info()["id"]
+    return DEVICE_IDS[device_token]
+
+
+def scope_records(scope: list, variables: list[str], device_id: str) -> list[dict]:
+    """Records of the variables in the scope of an action, with the time as in getData.
+
+    Args:
+        scope (list): Scope of the analysis, empty when it's not run by an action
+        variables (list[str]): Variables read by the formulas
+        device_id (str): Id of the device, the scope may have records of other devices
+
+    Returns:
+        list[dict]: Copies of the records of the variables of the device
+    """
+    records = [
+        dict(item)
+        for item in scope or []
+        if item.get("variable") in variables and item.get("device") == device_id
+    ]
+    return dateParserList(records, ["time"])
+
+
+def row_key(record: dict):
+    return record.get("group") or record.get("time")
+
+
+def latest_row_key(_record: dict) -> None:
+    # The last value of each variable goes to the same row.
+    return None
+
+
+def build_columns(
+    records: list[dict], variables: list[str], key=row_key
+) -> tuple[list[dict], dict]:
+    """Align the records in rows, with one array of values for each variable.
+
+    Args:
+        records (list[dict]): Records from getData
+        variables (list[str]): Variables read by the formulas
+        key (Callable): Row of each record, by default its group or its time
+
+    Returns:
+        tuple[list[dict], dict]: The time and group of each row, and the array of each
+        variable, with NaN where a row doesn't have the variable
+    """
+    rows = {}
+    for record in records:
+        row = rows.setdefault(key(record), {"time": record.get("time")})
+        # A row takes the time and the group of its newest record.
+        if record.get("time") and (not row["time"] or record["time"] > row["time"]):
+            row["time"] = record["time"]
+        if record.get("group") and row["time"] == record.get("time"):
+            row["group"] = record["group"]
+
+    positions = {key: position for position, key in enumerate(rows)}
+    columns = {variable: np.full(len(rows), np.nan) for variable in variables}
+    for record in records:
+        if record.get("variable") not in columns:
+            continue
+        try:
+            value = float(record["value"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        columns[record["variable"]][positions[key(record)]] = value
+
+    return list(rows.values()), columns
+
+
+def calculate(
+    formulas: list[Formula], rows: list[dict], columns: dict[str, np.ndarray]
+) -> list[dict]:
+    """Calculate every formula and create the records of the new variables.
+
+    Rows without the variables of a formula, or with an invalid result such as the log
+    of a negative number, don't get a record for that formula.
+    """
+    data = []
+    with np.errstate(all="ignore"):
+        for formula in formulas:
+            values = np.broadcast_to(
+                np.asarray(formula.evaluate(columns), dtype=np.float64), len(rows)
+            )
+            columns[formula.output] = values
+            if formula.output.startswith("_"):
+                continue
+
+            valid = np.isfinite(values)
+            for row, value in zip(compress(rows, valid), values[valid].tolist()):
+                data.append({"variable": formula.output, "value": value, **row})
+    return data
+
+
+def newest_outputs(device: Device, formulas: list[Formula]) -> dict:
+    """Time of the last stored value of each output, by output."""
+    outputs = [
+        formula.output for formula in formulas if not formula.output.startswith("_")
+    ]
+    query_filter = {"variables": outputs, "query": "last_value"}
+    records = device.getData(queryParams=query_filter)
+    return {record["variable"]: record["time"] for record in records}
+
+
+def my_analysis(context, scope: list = None) -> None:
+    environment = envToJson(context.environment)
+
+    if not environment.get("device_token"):
+        return print("Missing device_token environment variable")
+
+    formulas, variables = compile_formulas(environment.get("formulas") or FORMULAS)
+    if not variables:
+        return print("The formulas don't read any device variable.")
+
+    device = Device(params={"token": environment["device_token"]})
+
+    # A single request reads all the variables used by the formulas.
+    if environment.get("start_date"):
+        query_filter = {
+            "variables": variables,
+            "start_date": environment["start_date"],
+            "qty": MAX_RECORDS,
+        }
+        records = device.getData(queryParams=query_filter)
+        key = row_key
+    else:
+        # The values in the scope are newer than the device data, so only the missing
+        # variables are read.
+        device_id = None
+        if any(item.get("variable") in variables for item in scope or []):
+            device_id = environment.get("device_id") or get_device_id(
+                device, environment["device_token"]
+            )
+        records = scope_records(scope, variables, device_id)
+        in_scope = {record["variable"] for record in records}
+        missing = [variable for variable in variables if variable not in in_scope]
+        if missing:
+            query_filter = {"variables": missing, "query": "last_value"}
+            records = device.getData(queryParams=query_filter) + records
+        key = latest_row_key
+
+    if not records:
+        return print("Empty Array")
+
+    rows, columns = build_columns(records, variables, key)
+    data = calculate(formulas, rows, columns)
+    if not data:
+        return print("No formula could be calculated with the device data.")
+
+    if environment.get("start_date"):
+        # The rows up to the last stored value of an output were sent by a previous run.
+        newest = newest_outputs(device, formulas)
+        data = [
+            record
+            for record in data
+            if record["variable"] not in newest
+            or record["time"] > newest[record["variable"]]
+        ]
+        if not data:
+            return print("The derived variables are up to date.")
+
+    # A single request sends the results of all the formulas.
+    result = device.sendData(data=data)
+    print(f"{len(data)} values of {len(formulas)} formulas: {result}")
+
+
+# The analysis token in only necessary to run the analysis outside TagoIO
+Analysis(params={"token": "MY-ANALYSIS-TOKEN-HERE"}).init(my_analysis)
@@ -4,7 +4,8 @@
 
 # /// script
 # dependencies = [
-#   "tagoio-sdk"
+#   "tagoio-sdk",
+#   "numpy"
 # ]
 # ///
 
@@ -15,6 +16,25 @@ Using an Input Widget in the dashboard, you will be able to trigger a downlink t
 any LoraWaN network server.
 You can get the dashboard template to use here: https://admin.tago.io/template/5f514218d4555600278023c4
 
+Every "form_payload" in the scope becomes a downlink command. The commands go through a
+dispatcher that drops repeated commands for the same device, sends to several devices at
+the same time and retries the downlinks that fail for a temporary reason, such as a
+network error or a 429 or 5xx answer of the network server, waiting a bit longer after
+each attempt. Other 4xx answers, and devices without token or network, are not retried.
+With tag_key and tag_value set, the same command is sent to every device with that tag.
+
+Instead of a hex "form_payload", the dashboard can send one variable for each setting of
+PAYLOAD_SCHEMA, named "form_" plus the setting name (form_interval, form_threshold...).
+Settings with a default in the schema can be left out of the form. The downlink goes to
+the device that stores the form variables, unless tag_key and tag_value are set.
+The schema is compiled once into a packing plan, and the payloads of all the devices are
+encoded together with numpy. When sending to devices by tag, a device tag with the name of
+a setting overrides the value from the dashboard for that device.
+
+Before each downlink, TagoIO has to find the device token, the device network and the
+middleware endpoint of that network. Those lookups are cached for a while (cache_ttl), so
+sending to many devices of the same network looks up the network only once.
+
 Environment Variables
 In order to use this analysis, you must setup the Environment Variable table.
 
@@ -22,6 +42,11 @@ account_token: Your account token. Check bellow how to get this.
 default_PORT: The default port to be used if not sent by the dashboard.
 device_id: The default device id to be used if not sent by the dashboard (OPTIONAL).
 payload: The default payload to be used if not sent by the dashboard (OPTIONAL).
+tag_key: Send the downlink to every device with this tag key (OPTIONAL).
+tag_value: Send the downlink to every device with this tag value (OPTIONAL).
+max_workers: Downlinks sent at the same time (OPTIONAL, default: 5).
+max_attempts: Attempts for each downlink (OPTIONAL, default: 3).
+cache_ttl: Seconds the device and network lookups are reused (OPTIONAL, default: 300).
 
 Steps to generate an account_token:
 1 - Enter the following link: https://admin.tago.io/account/
@@ -31,45 +56,450 @@ Steps to generate an account_token:
 5 - Press the Copy Button and place at the Environment Variables tab of this analysis.
 """
 
+import json
+import random
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 from tagoio_sdk import Account, Analysis
-from tagoio_sdk.modules.Utils.sendDownlink import sendDownlink
+from tagoio_sdk.modules.Utils.envToJson import envToJson
+from tagoio_sdk.modules.Utils.sendDownlink import (
+    getDeviceToken,
+    getDownlinkParams,
+    getMiddlewareEndpoint,
+    getNetworkId,
+    putParamInDevice,
+)
+
+# Layout of the configuration downlink of your device.
+# offset and width are in bits. Fields that start and end on a byte boundary, with
+# 8, 16, 32 or 64 bits, use the given endianness. Other fields are packed in big-endian
+# bit order, offset 0 being the most significant bit of the first byte.
+# The value sent is round(setting / scale). Fields with a default are optional.
+PAYLOAD_SCHEMA = [
+    {"name": "interval", "offset": 0, "width": 16, "endianness": "big"},
+    {"name": "threshold", "offset": 16, "width": 16, "scale": 0.1, "signed": True},
+    {"name": "led", "offset": 32, "width": 1, "default": 0},
+    {"name": "mode", "offset": 33, "width": 3, "default": 0},
+]
+
+# Errors that won't go away by trying again, such as a device without network or a 4xx
+# answer of the network server. A 429 or 5xx answer raises requests.HTTPError instead.
+PERMANENT_ERRORS = (TypeError, ValueError)
+
+
+class PayloadSchema:
+    """Downlink payload layout compiled once into a numpy packing plan.
+
+    Args:
+        fields (list[dict]): name, offset and width in bits, and optionally scale,
+            signed, endianness ("big" or "little", default "big") and default, the
+            value used when a payload doesn't have the setting
+    """
+
+    def __init__(self, fields: list[dict]) -> None:
+        # Bytes up to the end of the last field, rounded up.
+        self.size = -(-max(field["offset"] + field["width"] for field in fields) // 8)
+        end, previous = 0, None
+        for field in sorted(fields, key=lambda field: field["offset"]):
+            if field["offset"] < end:
+                raise ValueError(f"Fields {previous} and {field['name']} overlap")
+            end, previous = field["offset"] + field["width"], field["name"]
+        self.names = [field["name"] for field in fields]
+        self.defaults = {
+            field["name"]: field["default"] for field in fields if "default" in field
+        }
+        self.plan = []
+        for field in fields:
+            offset, width = field["offset"], field["width"]
+            signed = field.get("signed", False)
+            low = -(2 ** (width - 1)) if signed else 0
+            high = 2 ** (width - 1) - 1 if signed else 2**width - 1
+
+            if offset % 8 == 0 and width in (8, 16, 32, 64):
+                byte_order = "<" if field.get("endianness") == "little" else ">"
+                kind = "i" if signed else "u"
+                dtype = f"{byte_order}{kind}{width // 8}"
+            elif (offset % 8) + width <= 64:
+                # Placed in a big-endian 64 bits window that starts on its first byte.
+                dtype = None
+            else:
+                raise ValueError(f"Field {field['name']} is too wide to be packed")
+
+            self.plan.append(
+                (field["name"], offset, width, field.get("scale", 1), low, high, dtype)
+            )
+
+    def encode_many(self, settings: list[dict]) -> list[str]:
+        """Encode many settings at once.
+
+        Args:
+            settings (list[dict]): Value of every field, for each payload
+
+        Returns:
+            list[str]: Payloads in hex, in the same order
+
+        Raises:
+            ValueError: When a setting without default is missing
+        """
+        missing = {
+            name
+            for row in settings
+            for name in self.names
+            if name not in row and name not in self.defaults
+        }
+        if missing:
+            raise ValueError(f"Missing settings: {', '.join(sorted(missing))}")
+
+        # numpy is only imported when there are settings to encode, so the runs that
+        # send a hex form_payload start without loading it.
+        import numpy as np
+
+        count = len(settings)
+        # 8 extra bytes, so a bit field window never runs past the end.
+        buffer = np.zeros((count, self.size + 8), dtype=np.uint8)
+
+        for name, offset, width, scale, low, high, dtype in self.plan:
+            values = np.asarray(
+                [row.get(name, self.defaults.get(name)) for row in settings],
+                dtype=np.float64,
+            )
+            raw = np.rint(values / scale).astype(np.int64)
+            if raw.size and (raw.min() < low or raw.max() > high):
+                raise ValueError(
+                    f"{name} must be between {low * scale} and {high * scale}"
+                )
+
+            start = offset // 8
+            if dtype is not None:
+                size = width // 8
+                buffer[:, start : start + size] = (
+                    raw.astype(dtype).view(np.uint8).reshape(count, size)
+                )
+                continue
+
+            shift = 64 - (offset % 8) - width
+            bits = (raw.astype(np.uint64) & np.uint64(2**width - 1)) << np.uint64(shift)
+            buffer[:, start : start + 8] |= (
+                bits.astype(">u8").view(np.uint8).reshape(count, 8)
+            )
+
+        payloads = np.ascontiguousarray(buffer[:, : self.size]).tobytes().hex()
+        step = 2 * self.size
+        return [
+            payloads[index : index + step] for index in range(0, len(payloads), step)
+        ]
+
+    def encode(self, settings: dict) -> str:
+        """Encode the settings of a single payload."""
+        return self.encode_many([settings])[0]
+
+
+COMPILED_SCHEMA = PayloadSchema(PAYLOAD_SCHEMA)
+
+
+class TTLCache:
+    """Thread-safe cache where each value expires after ttl seconds.
+
+    Concurrent misses on the same key wait for a single load instead of
+    repeating it.
+
+    Args:
+        ttl (float): Seconds a value is kept
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self.values = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def get(self, key, load: Callable[[], object]):
+        """Get the value of the key, calling load when it is missing or expired."""
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            cached = self.values.get(key)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+            value = load()
+            self.values[key] = (value, time.monotonic() + self.ttl)
+            return value
+
+
+class DownlinkClient:
+    """Sends downlinks like sendDownlink, caching the device and network lookups.
+
+    Args:
+        account (Account): Instance of the Account class
+        ttl (float): Seconds the lookups are reused
+    """
+
+    def __init__(self, account: Account, ttl: float = 300) -> None:
+        self.account = account
+        self.devices = TTLCache(ttl)
+        self.networks = TTLCache(ttl)
+        self.session = requests.Session()
+
+    def resolve(self, device_id: str) -> tuple[dict, str]:
+        """Get the token of the device and the middleware endpoint of its network."""
+
+        def load_device() -> tuple[dict, str]:
+            token = getDeviceToken(self.account, device_id)
+            return token, getNetworkId(self.account, device_id)
+
+        token, network_id = self.devices.get(device_id, load_device)
+        endpoint = self.networks.get(
+            network_id, lambda: getMiddlewareEndpoint(self.account, network_id)
+        )
+        return token, endpoint
+
+    def send(self, device_id: str, dn_options: dict) -> str:
+        """Perform the downlink, same as sendDownlink.
+
+        Args:
+            device_id (str): Id of the device
+            dn_options (dict): port, payload and, optionally, confirmed
+
+        Returns:
+            str: Status of the downlink
+        """
+        token, endpoint = self.resolve(device_id)
+
+        # The downlink parameter is created on the first downlink, so it isn't cached.
+        downlink_param = getDownlinkParams(self.account, device_id)
+        putParamInDevice(
+            self.account,
+            device_id,
+            {
+                "id": downlink_param[0]["id"] if downlink_param else None,
+                "key": "downlink",
+                "value": str(dn_options["payload"]),
+                "sent": False,
+            },
+        )
+
+        data = {
+            "device": token["serie_number"],
+            "authorization": token["last_authorization"],
+            "payload": dn_options["payload"],
+            "port": dn_options["port"],
+        }
+        if dn_options.get("confirmed") is not None:
+            data["confirmed"] = dn_options["confirmed"]
+
+        result = self.session.post(
+            url=f"https://{endpoint}/downlink",
+            data=json.dumps(data),
+            headers={"Content-Type": "application/json"},
+            timeout=30,
+        )
+        # Too many requests and server errors may go away, so they are retried.
+        if result.status_code == 429 or result.status_code >= 500:
+            raise requests.HTTPError(
+                f"Downlink failed with status {result.status_code}: {result.text}",
+                response=result,
+            )
+        if 400 <= result.status_code < 500:
+            raise TypeError(
+                f"Downlink failed with status {result.status_code}: {result.text}"
+            )
+
+        return f"Downlink accepted with status code - {result.status_code}"
+
+
+class DownlinkDispatcher:
+    """Queue of downlink commands, sent concurrently with retries.
+
+    Args:
+        client (DownlinkClient): Client that sends the downlinks
+        max_workers (int): Downlinks sent at the same time
+        max_attempts (int): Attempts for each downlink
+        backoff (float): Seconds to wait before the first retry, doubled on each retry
+    """
+
+    def __init__(
+        self,
+        client: DownlinkClient,
+        max_workers: int = 5,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+    ) -> None:
+        self.client = client
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.pending = {}
+
+    def add(self, device_id: str, port, payload: str) -> bool:
+        """Queue a command, unless the same command is already pending for the device.
+
+        Returns:
+            bool: True if the command was queued
+        """
+        commands = self.pending.setdefault(device_id, [])
+        command = {"port": port, "payload": payload}
+        if command in commands:
+            return False
+        commands.append(command)
+        return True
+
+    def send(self, device_id: str, command: dict) -> str:
+        """Send one downlink, retrying with exponential backoff and jitter."""
+        attempt = 1
+        while True:
+            try:
+                return self.client.send(device_id, command)
+            except PERMANENT_ERRORS:
+                raise
+            except Exception as error:
+                if attempt >= self.max_attempts:
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                print(f"{device_id}: attempt {attempt} failed ({error}), retrying")
+                time.sleep(delay)
+                attempt += 1
+
+    def send_device(self, device_id: str, commands: list[dict]) -> list:
+        """Send the commands of one device in the order they were queued."""
+        results = []
+        for command in commands:
+            try:
+                results.append(self.send(device_id, command))
+            except Exception as error:
+                results.append(error)
+        return results
+
+    def dispatch(self) -> dict[str, list]:
+        """Send every pending command. Commands of different devices run in parallel.
+
+        Returns:
+            dict[str, list]: Result or error of each command, by device
+        """
+        pending, self.pending = self.pending, {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                device_id: executor.submit(self.send_device, device_id, commands)
+                for device_id, commands in pending.items()
+            }
+        return {device_id: future.result() for device_id, future in futures.items()}
+
+
+def list_devices_by_tag(account: Account, tag_key: str, tag_value: str) -> list:
+    """Get the id and tags of every device of the account with the given tag."""
+    devices = []
+    page = 1
+    while True:
+        result = account.devices.listDevice(
+            {
+                "page": page,
+                "amount": 1000,
+                "fields": ["id", "tags"],
+                "filter": {"tags": [{"key": tag_key, "value": tag_value}]},
+            }
+        )
+        devices.extend(result)
+        if len(result) < 1000:
+            return devices
+        page += 1
 
 
 # The function myAnalysis will run when you execute your analysis
 def my_analysis(context, scope: list[dict]) -> None:
-    account_token = list(
-        filter(
-            lambda account_token: account_token["key"] == "account_token",
-            context.environment,
-        )
-    )
+    environment = envToJson(context.environment)
 
-    if not account_token:
-        return ValueError("Missing value: 'account_token' Environment Variable.")
+    if not environment.get("account_token"):
+        raise ValueError("Missing value: 'account_token' Environment Variable.")
 
-    my_account = Account({"token": account_token[0]["value"]})
+    my_account = Account({"token": environment["account_token"]})
     # Get the variables form_payload, form_port and device_id sent by the widget/dashboard.
-    payload = list(filter(lambda payload: payload["variable"] == "form_payload", scope))
+    payloads = [item for item in scope if item["variable"] == "form_payload"]
+    if not payloads and environment.get("payload"):
+        payloads = [{"payload": environment["payload"]}]
 
-    if not payload:
-        return print('Missing "form_payload" in the data scope.')
+    # Or the settings used to build the payload with PAYLOAD_SCHEMA.
+    setting_items = [
+        item
+        for item in scope
+        if item["variable"].startswith("form_")
+        and item["variable"][len("form_") :] in COMPILED_SCHEMA.names
+    ]
+    settings = {
+        item["variable"][len("form_") :]: item["value"] for item in setting_items
+    }
 
-    device_id = payload[0]["device_id"]
-    payload = payload[0]["payload"]
+    if not payloads and not settings:
+        return print('Missing "form_payload" in the data scope.')
 
-    port = list(filter(lambda payload: payload["variable"] == "form_port", scope))
+    port = next(
+        (item["value"] for item in scope if item["variable"] == "form_port"),
+        environment.get("default_PORT"),
+    )
 
     if not port:
         return print('Missing "form_port" in the data scope o.')
 
-    port = port[0]["value"]
+    devices = []
+    if environment.get("tag_key") and environment.get("tag_value"):
+        devices = list_devices_by_tag(
+            my_account, environment["tag_key"], environment["tag_value"]
+        )
+    else:
+        # The form stores its variables in the device that receives the downlink.
+        device_id = next(
+            (
+                item.get("device_id") or item.get("device")
+                for item in payloads + setting_items
+                if item.get("device_id") or item.get("device")
+            ),
+            environment.get("device_id"),
+        )
+        devices = [{"id": device_id, "tags": []}] if device_id else []
 
-    result = sendDownlink(
-        account=my_account,
-        device_id=device_id,
-        dn_options={"port": port, "payload": payload},
+    client = DownlinkClient(my_account, ttl=float(environment.get("cache_ttl") or 300))
+    dispatcher = DownlinkDispatcher(
+        client,
+        max_workers=int(environment.get("max_workers") or 5),
+        max_attempts=int(environment.get("max_attempts") or 3),
     )
-    print(result)
+    if payloads:
+        for item in payloads:
+            payload = item.get("payload") or item.get("value")
+            targets = devices or [{"id": item.get("device_id") or item.get("device")}]
+            for device in targets:
+                if device["id"]:
+                    dispatcher.add(device["id"], port, payload)
+    else:
+        # Device tags with the name of a setting override the dashboard value.
+        device_settings = [
+            {
+                **settings,
+                **{
+                    tag["key"]: tag["value"]
+                    for tag in device["tags"]
+                    if tag["key"] in COMPILED_SCHEMA.names
+                },
+            }
+            for device in devices
+        ]
+        encoded = COMPILED_SCHEMA.encode_many(device_settings)
+        for device, payload in zip(devices, encoded):
+            dispatcher.add(device["id"], port, payload)
+
+    if not dispatcher.pending:
+        return print(
+            "No device to send the downlink to. Send it from a device form, or set "
+            'the "device_id" or the "tag_key" and "tag_value" environment variables.'
+        )
+
+    results = dispatcher.dispatch()
+    for device_id, device_results in results.items():
+        for result in device_results:
+            print(f"{device_id}: {result}")
 
 
 # The analysis token in only necessary to run the analysis outside TagoIO
@@ -15,6 +15,11 @@ Operate data from devices
 Read information from a variable generated by devices,
 run a simple calculation in real-time, and create a new variable with the output.
 
+When an action triggers this analysis with a new temperature of the device, the newest
+value is taken from the scope, and the data is only read from the device when the scope
+doesn't have it. The id of the device, needed to find its data in the scope, is read once
+and kept for the next runs, or taken from the optional device_id environment variable.
+
 Instructions
 To run this analysis you need to add a device token to the environment variables,
 To do that, go to your device, then token and copy your token.
@@ -24,6 +29,15 @@ type device_token on key, and paste your token on value
 
 from tagoio_sdk import Analysis, Device
 
+# Device id by device token, kept between runs so the id is only requested once.
+DEVICE_IDS: dict[str, str] = {}
+
+
+def get_device_id(device: Device, device_token: str) -> str:
+    if device_token not in DEVICE_IDS:
+        DEVICE_IDS[device_token] = device.info()["id"]
+    return DEVICE_IDS[device_token]
+
 
 def my_analysis(context, scope: list = None) -> str:
     # reads the value of account_token from the environment variable
@@ -42,13 +56,33 @@ def my_analysis(context, scope: list = None) -> str:
         "query": "last_item",
     }
 
-    result_array = device.getData(queryParams=query_filter)
+    # Actions send the new data in the scope, so it doesn't need to be read again.
+    # The scope may have the data of other devices, so only this device is used.
+    result_array = [
+        item for item in scope or [] if item.get("variable") == "temperature"
+    ]
+    if result_array:
+        device_id = next(
+            (
+                item["value"]
+                for item in context.environment
+                if item["key"] == "device_id"
+            ),
+            None,
+        ) or get_device_id(device, device_token["value"])
+        result_array = [
+            item for item in result_array if item.get("device") == device_id
+        ]
+        # The scope isn't sorted, so the newest record is the one with the latest time.
+        result_array = sorted(result_array, key=lambda item: str(item.get("time")))[-1:]
+    if not result_array:
+        result_array = device.getData(queryParams=query_filter)
 
     # Check if the array is not empty
     if not result_array or not result_array[0]:
         return print("Empty Array")
 
-    # query:last_item always returns only one value
+    # query:last_item always returns only one value, and the scope the newest one
     value = result_array[0]["value"]
     time = result_array[0]["time"]
 
@@ -0,0 +1,231 @@
+# @title: Fleet Email Export
+# @description: Export data from every device with a given tag into one time-sorted CSV sent by email
+# @tags: email, export, data, attachment, reporting, fleet, concurrency
+
+# /// script
+# dependencies = [
+#   "tagoio-sdk"
+# ]
+# ///
+
+"""
+Analysis Example
+Fleet email export
+
+Learn how to export the data of many devices in a single analysis run.
+
+This analysis selects the devices by tag, reads their data in parallel with a bounded
+number of simultaneous requests, and merges all the records by time into one .csv file
+that is sent to an e-mail address.
+
+Each device is read page by page. The next page of a device is only requested when the
+current one starts being consumed, so the memory used by the merge stays around two pages
+per device, no matter how much data the fleet has.
+
+Environment Variables
+In order to use this analysis, you must setup the Environment Variable table.
+
+account_token: Your account token. Check bellow how to get this.
+email: The e-mail address that will receive the export.
+tag_key: Device tag Key to filter the devices.
+tag_value: Device tag Value to filter the devices.
+variables: Variables to export, comma separated (OPTIONAL, default: fuel_level).
+start_date: How far back to export (OPTIONAL, default: 7 days).
+max_workers: Maximum of simultaneous requests to TagoIO (OPTIONAL, default: 10).
+
+Steps to generate an account_token:
+1 - Enter the following link: https://admin.tago.io/account/
+2 - Select your Profile.
+3 - Enter Tokens tab.
+4 - Generate a new Token with Expires Never.
+5 - Press the Copy Button and place at the Environment Variables tab of this analysis.
+"""
+
+import csv
+import heapq
+import io
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from tagoio_sdk import Account, Analysis, Services
+from tagoio_sdk.modules.Utils.envToJson import envToJson
+
+# Amount of records requested to TagoIO in each page.
+PAGE_SIZE = 1000
+
+# Amount of devices requested to TagoIO in each page of the device list.
+DEVICE_PAGE_SIZE = 1000
+
+CSV_HEADER = ["device", "variable", "value", "unit", "time"]
+
+
+def list_devices_by_tag(account: Account, tag_key: str, tag_value: str) -> list[dict]:
+    """Get every device of the account that has the given tag.
+
+    Args:
+        account (Account): Instance of the Account class
+        tag_key (str): Key of the tag
+        tag_value (str): Value of the tag
+
+    Returns:
+        list[dict]: List of devices with id and name
+    """
+    devices = []
+    page = 1
+    while True:
+        result = account.devices.listDevice(
+            {
+                "page": page,
+                "amount": DEVICE_PAGE_SIZE,
+                "fields": ["id", "name"],
+                "filter": {"tags": [{"key": tag_key, "value": tag_value}]},
+            }
+        )
+        devices.extend(result)
+        if len(result) < DEVICE_PAGE_SIZE:
+            return devices
+        page += 1
+
+
+def fetch_page(account: Account, device_id: str, query: dict, skip: int) -> list:
+    """Get one page of data of a device, oldest records first."""
+    return account.devices.getDeviceData(
+        device_id,
+        {**query, "qty": PAGE_SIZE, "skip": skip, "ordination": "ascending"},
+    )
+
+
+def device_stream(
+    executor: ThreadPoolExecutor,
+    account: Account,
+    device: dict,
+    query: dict,
+    first_page: Future,
+) -> Iterator[dict]:
+    """Yield the records of a device in time order, reading one page ahead.
+
+    Args:
+        executor (ThreadPoolExecutor): Pool that runs the requests
+        account (Account): Instance of the Account class
+        device (dict): Device with id and name
+        query (dict): Filter used to get the data
+        first_page (Future): Request of the first page, already submitted to the pool
+
+    Yields:
+        dict: Record of the device, with the device name added
+    """
+    skip = 0
+    future = first_page
+    while future is not None:
+        page = future.result()
+        skip += len(page)
+
+        # Ask for the next page before handing out this one.
+        future = None
+        if len(page) == PAGE_SIZE:
+            future = executor.submit(fetch_page, account, device["id"], query, skip)
+
+        for item in page:
+            yield {**item, "device": device["name"]}
+
+
+def build_fleet_csv(
+    account: Account, devices: list[dict], query: dict, max_workers: int
+) -> tuple[str, int]:
+    """Merge the data of all the devices by time into a csv text.
+
+    Args:
+        account (Account): Instance of the Account class
+        devices (list[dict]): Devices to export
+        query (dict): Filter used to get the data
+        max_workers (int): Maximum of simultaneous requests to TagoIO
+
+    Returns:
+        tuple[str, int]: The csv text and the amount of records in it
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+    rows = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Request the first page of every device at once, so the merge below
+        # doesn't wait for the devices one after another.
+        first_pages = [
+            executor.submit(fetch_page, account, device["id"], query, 0)
+            for device in devices
+        ]
+        streams = [
+            device_stream(executor, account, device, query, first_page)
+            for device, first_page in zip(devices, first_pages)
+        ]
+
+        # k-way merge: only the head record of each device is compared at a time.
+        for item in heapq.merge(*streams, key=lambda item: item["time"]):
+            writer.writerow(
+                [
+                    item["device"],
+                    item["variable"],
+                    item.get("value"),
+                    item.get("unit", ""),
+                    item["time"].isoformat(),
+                ]
+            )
+            rows += 1
+
+    return output.getvalue(), rows
+
+
+# The function myAnalysis will run when you execute your analysis
+def my_analysis(context, scope: list = None) -> None:
+    # reads the values from the environment and saves it in the variable env_vars
+    env_vars = envToJson(context.environment)
+
+    for key in ("account_token", "email", "tag_key", "tag_value"):
+        if not env_vars.get(key):
+            raise ValueError(f"Missing value: '{key}' environment variable not found")
+
+    variables = [
+        variable.strip()
+        for variable in env_vars.get("variables", "fuel_level").split(",")
+        if variable.strip()
+    ]
+    query = {
+        "variables": variables,
+        "start_date": env_vars.get("start_date") or "7 days",
+    }
+    max_workers = int(env_vars.get("max_workers") or 10)
+
+    account = Account({"token": env_vars["account_token"]})
+
+    devices = list_devices_by_tag(account, env_vars["tag_key"], env_vars["tag_value"])
+    if not devices:
+        return print(
+            f"No device found with the tag {env_vars['tag_key']}={env_vars['tag_value']}"
+        )
+
+    print(f"Exporting {', '.join(variables)} from {len(devices)} devices")
+    csv_text, rows = build_fleet_csv(account, devices, query, max_workers)
+    print(f"Exported {rows} records")
+
+    # Start the email service
+    email = Services({"token": context.token}).email
+
+    # Send the email.
+    service_response = email.send(
+        {
+            "message": f"Data export of {len(devices)} devices, {rows} records.",
+            "subject": "Fleet Exported File from TagoIO",
+            "to": env_vars["email"],
+            "attachment": {
+                "archive": csv_text,
+                "filename": "fleet_exported_file.csv",
+            },
+        }
+    )
+
+    print(service_response)
+
+
+# The analysis token in only necessary to run the analysis outside TagoIO
+Analysis(params={"token": "MY-ANALYSIS-TOKEN-HERE"}).init(my_analysis)
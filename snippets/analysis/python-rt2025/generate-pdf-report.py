@@ -4,7 +4,8 @@
 
 # /// script
 # dependencies = [
-#   "tagoio-sdk"
+#   "tagoio-sdk",
+#   "numpy"
 # ]
 # ///
 
@@ -12,150 +13,636 @@
 Analysis Example
 Generate pdf report and send via email
 
+The report templates are compiled once when the analysis starts. While the data is read
+from the device page by page, each variable is stored in compact arrays. Every series is
+then reduced to a fixed amount of points with Largest-Triangle-Three-Buckets (LTTB),
+which keeps the peaks and the shape of the curve, and drawn as an inline SVG chart. The
+table still lists every record, rendered row by row as the pages arrive, including the
+records whose value is not a number and can't be charted.
+
+Every piece of HTML is appended to a list, so the document is not copied over and over.
+That list is then base64 encoded in chunks, releasing each piece of HTML as soon as it is
+encoded, so the full HTML never exists as one string or as bytes. The PDF service needs
+the base64 as a single string, and joining the chunks holds both for a moment, so the
+peak memory is about twice the base64 size (a third larger than the HTML), plus the
+copy the SDK makes when it serializes the request.
+
+The analysis can also run in batch mode, generating one report for every device with a
+given tag. The reports are built by a pool of workers, and the calls to the PDF and
+email services are limited to a few at a time. The PDF service can be replaced by any
+URL that accepts the same request, such as a local stub used for load tests.
+
 Instructions
 To run this analysis you need to add a email and device_token to the environment variables,
 Go the the analysis, then environment variables,
 type email on key, and insert your email on value
 type device_token on key and insert your device token on value
+start_date: How far back the report goes (OPTIONAL, default: 1 month).
+report_points: Points drawn in the chart of each variable (OPTIONAL, default: 500).
+
+Batch mode
+Replace device_token by the following environment variables.
+account_token: Your account token.
+tag_key: Device tag Key to filter the devices.
+tag_value: Device tag Value to filter the devices.
+email: Used for the devices that don't have an "email" tag.
+max_workers: Reports built at the same time (OPTIONAL, default: 5).
+service_concurrency: Simultaneous calls to the PDF and email services (OPTIONAL, default: 2).
+pdf_service_url: Send the PDF requests to this URL instead of TagoIO (OPTIONAL).
 """
 
 import base64
+import html
+import re
+import threading
+from array import array
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import partial
+from typing import Union
 
-from tagoio_sdk import Analysis, Device, Services
+import numpy as np
+import requests
+from tagoio_sdk import Account, Analysis, Device, Services
+from tagoio_sdk.modules.Services.PDF import PDFService
 from tagoio_sdk.modules.Utils.envToJson import envToJson
 
 DEVICE_VARIABLES = [
     "your_variable"
 ]  # enter the variable from your device you would like
 
+# Amount of records requested to TagoIO in each page.
+PAGE_SIZE = 1000
+
+# Amount of devices requested to TagoIO in each page of the device list.
+DEVICE_PAGE_SIZE = 1000
+
+# Amount of HTML bytes base64 encoded at a time. Must be a multiple of 3.
+BASE64_CHUNK_SIZE = 3 * 2**16
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+PDF_OPTIONS = {
+    "displayHeaderFooter": True,
+    "footerTemplate": '<div class="page-footer" style="width:100%; text-align:center; font-size:12px;">Page <span class="pageNumber"></span> of <span class="totalPages"></span></div>',
+    "margin": {
+        "top": "1.5cm",
+        "right": "1.5cm",
+        "left": "1.5cm",
+        "bottom": "1.5cm",
+    },
+}
+
+# Size of the SVG charts, in pixels.
+CHART_WIDTH = 700
+CHART_HEIGHT = 180
+
+
+class CompiledTemplate:
+    """HTML template with {{ field }} placeholders, compiled once into a format string.
+
+    Args:
+        source (str): Template text
+    """
+
+    FIELD_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+    def __init__(self, source: str) -> None:
+        parts = []
+        position = 0
+        for match in self.FIELD_PATTERN.finditer(source):
+            literal = source[position : match.start()]
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            parts.append(f"{{{match.group(1)}}}")
+            position = match.end()
+        literal = source[position:]
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+
+        self._format = "".join(parts).format_map
+
+    def render_into(self, buffer: list[str], values: dict) -> None:
+        """Append the rendered template to the buffer, escaping every value."""
+        buffer.append(
+            self._format(
+                {key: html.escape(str(value)) for key, value in values.items()}
+            )
+        )
+
 
-def html_content_for_pdf(dataVal, dataVar) -> None:
-    return f"""
+REPORT_HEAD = CompiledTemplate(
+    """
+    <html>
     <head>
         <style>
-            body, html {{
+            body, html {
                 margin: 0;
-            }}
-            table {{
+            }
+            table {
                 width: 100%;
                 border-collapse: collapse;
-            }}
-            td {{
+            }
+            td {
                 border: 1px solid black;
                 padding: 5px;
-                padding-bottom: 25px;
                 font-style: italic;
-            }}
+            }
+            svg {
+                display: block;
+                margin: 10px 0;
+            }
+            svg text {
+                font-size: 10px;
+            }
         </style>
     </head>
     <body>
     <table>
         <tr>
-            <td colspan="7">Issue date: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</td>
+            <td colspan="6">Issue date: {{ issue_date }}</td>
         </tr>
         <tr>
-            <td colspan="4">Start date: 2020-05-20 10:21:32</td>
-            <td colspan="3">Stop date: 2020-10-08 22:56:19</td>
+            <td colspan="3">Start date: {{ start_date }}</td>
+            <td colspan="3">Stop date: {{ stop_date }}</td>
         </tr>
         <tr>
-            <td colspan="4"> Report of the {dataVar}</td>
-            <td colspan="3">Device Kitchen Oven 5</td>
+            <td colspan="3">Report of the {{ variables }}</td>
+            <td colspan="3">Device {{ device_name }}</td>
         </tr>
         <tr>
             <td>Counter</td>
-            <td>{dataVar}</td>
-            <td>Time</td>
+            <td>Variable</td>
+            <td>Value</td>
+            <td>Unit</td>
             <td>Date</td>
-            <td>Temperature 2</td>
             <td>Time</td>
-            <td>Date</td>
-        </tr>
-        <tr>
-        <td>2</td>
-        <td>{dataVal}</td>
-        <td>10:53:20</td>
-        <td>2020-06-10</td>
-        <td>137</td>
-        <td>10:53:20</td>
-        <td>2020-06-10</td>
         </tr>
+    """
+)
+
+REPORT_CHART = CompiledTemplate(
+    """
+    <svg xmlns="http://www.w3.org/2000/svg" width="{{ width }}" height="{{ height }}">
+        <rect width="100%" height="100%" fill="none" stroke="black" />
+        <text x="4" y="12">{{ variable }} ({{ unit }}) max {{ max_value }}</text>
+        <text x="4" y="{{ bottom }}">min {{ min_value }}</text>
+        <text x="{{ width }}" y="{{ bottom }}" text-anchor="end">{{ points_label }}</text>
+        <polyline fill="none" stroke="steelblue" stroke-width="1" points="{{ points }}" />
+    </svg>
+    """
+)
+
+REPORT_ROW = CompiledTemplate(
+    "<tr><td>{{ counter }}</td><td>{{ variable }}</td><td>{{ value }}</td>"
+    "<td>{{ unit }}</td><td>{{ date }}</td><td>{{ time }}</td></tr>\n"
+)
+
+REPORT_TABLE_END = """
     </table>
+    """
+
+REPORT_TAIL = """
     </body>
     </html>
     """
 
 
-# The function myAnalysis will run when you execute your analysis
-def my_analysis(context: any, scope: list = None) -> None:
-    # reads the values from the environment and saves it in the variable envVars
-    envVars = envToJson(context.environment)
+def iter_device_data(
+    get_data: Callable[[dict], list], variables: list[str], start_date: str
+) -> Iterator[dict]:
+    """Read the device data page by page, oldest records first.
 
-    if not envVars.get("email"):
-        raise ValueError("email environment variable not found")
-    if not envVars.get("device_token"):
-        raise ValueError("device_token environment variable not found")
+    Args:
+        get_data (Callable[[dict], list]): Function that reads the data with a query,
+            such as Device.getData
+        variables (list[str]): Variables to read
+        start_date (str): How far back to read
 
-    device = Device({"token": envVars["device_token"]})
+    Yields:
+        dict: One record of the device
+    """
+    skip = 0
+    while True:
+        page = get_data(
+            {
+                "variables": variables,
+                "start_date": start_date,
+                "qty": PAGE_SIZE,
+                "skip": skip,
+                "ordination": "ascending",
+            }
+        )
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        skip += len(page)
+
+
+class Series:
+    """Times and numeric values of one variable, stored in compact arrays."""
+
+    def __init__(self, unit: str) -> None:
+        self.unit = unit
+        self.times = array("d")
+        self.values = array("d")
+        self.skipped = 0
+
+    def append(self, timestamp: float, value) -> None:
+        """Add a record, counting the values that are not numbers in skipped."""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            self.skipped += 1
+            return
+        self.times.append(timestamp)
+        self.values.append(value)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Downsample a series with Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The other points are split in
+    threshold - 2 buckets, and from each bucket the point kept is the one that forms
+    the largest triangle with the point kept before it and the average of the next
+    bucket. The bucket averages and the triangle areas are computed with numpy.
+
+    Args:
+        x (np.ndarray): Times of the series, ascending
+        y (np.ndarray): Values of the series
+        threshold (int): Amount of points to keep
+
+    Returns:
+        np.ndarray: Indexes of the points kept, ascending
+    """
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
 
-    variables_buckets = device.getData(
+    # Average of every bucket at once, from cumulative sums.
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    counts = ends - starts
+    avg_x = np.append((sum_x[ends] - sum_x[starts]) / counts, x[-1])
+    avg_y = np.append((sum_y[ends] - sum_y[starts]) / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    point = 0
+    for bucket in range(threshold - 2):
+        start, end = starts[bucket], ends[bucket]
+        next_x, next_y = avg_x[bucket + 1], avg_y[bucket + 1]
+        area = np.abs(
+            (x[point] - next_x) * (y[start:end] - y[point])
+            - (x[point] - x[start:end]) * (next_y - y[point])
+        )
+        point = start + int(np.argmax(area))
+        selected[bucket + 1] = point
+
+    return selected
+
+
+def render_chart(
+    buffer: list[str], variable: str, unit: str, x, y, records: int
+) -> None:
+    """Append an SVG line chart of the series to the buffer."""
+    x_min, x_max = x[0], x[-1]
+    y_min, y_max = float(y.min()), float(y.max())
+    px = (x - x_min) / ((x_max - x_min) or 1) * CHART_WIDTH
+    py = CHART_HEIGHT - (y - y_min) / ((y_max - y_min) or 1) * (CHART_HEIGHT - 30) - 15
+
+    REPORT_CHART.render_into(
+        buffer,
         {
-            "variables": DEVICE_VARIABLES,
-            "start_date": "1 month",
-            "qty": 10,
-        }
+            "width": CHART_WIDTH,
+            "height": CHART_HEIGHT,
+            "bottom": CHART_HEIGHT - 4,
+            "variable": variable,
+            "unit": unit or "-",
+            "min_value": f"{y_min:g}",
+            "max_value": f"{y_max:g}",
+            "points_label": f"{records} records, {len(x)} points",
+            "points": " ".join(f"{a:.1f},{b:.1f}" for a, b in zip(px, py)),
+        },
     )
 
-    dataParsed = "variable,value,unit,time"
 
-    for variable in variables_buckets:
-        dataParsed = f"{variable.get('variable')},{variable.get('value')},{variable.get('unit')},{variable.get('time')}"
+def render_report(
+    records: Iterator[dict], device_name: str, variables: list, report_points: int
+) -> list[str]:
+    """Render the report HTML from a stream of records.
 
-    dataArray = dataParsed.split(",")
-    dataVar = dataArray[0]
-    dataVal = dataArray[1]
+    Every record becomes a row of the table as it arrives. The numeric values are also
+    kept by variable, and each variable gets a chart with at most report_points points.
 
-    html = html_content_for_pdf(dataVal, dataVar)
+    Args:
+        records (Iterator[dict]): Records of the device, oldest first
+        device_name (str): Name shown in the report header
+        variables (list): Variables shown in the report header
+        report_points (int): Points drawn in the chart of each variable
 
-    options = {
-        "displayHeaderFooter": True,
-        "footerTemplate": '<div class="page-footer" style="width:100%; text-align:center; font-size:12px;">Page <span class="pageNumber"></span> of <span class="totalPages"></span></div>',
-        "margin": {
-            "top": "1.5cm",
-            "right": "1.5cm",
-            "left": "1.5cm",
-            "bottom": "1.5cm",
-        },
-    }
+    Returns:
+        list[str]: The pieces of the report HTML, in order
+    """
+    rows = []
+    series = {}
+    first_time = last_time = None
+    counter = 0
+    for counter, record in enumerate(records, start=1):
+        record_time = record["time"]
+        first_time = first_time or record_time
+        last_time = record_time
+        variable = record.get("variable")
+        unit = record.get("unit") or ""
+        REPORT_ROW.render_into(
+            rows,
+            {
+                "counter": counter,
+                "variable": variable,
+                "value": record.get("value"),
+                "unit": unit,
+                "date": record_time.strftime("%Y-%m-%d"),
+                "time": record_time.strftime("%H:%M:%S"),
+            },
+        )
+        if variable not in series:
+            series[variable] = Series(unit)
+        series[variable].append(record_time.timestamp(), record.get("value"))
 
-    base_64 = base64.b64encode(html.encode("utf-8")).decode("utf-8")
+    charts = []
+    for variable, data in series.items():
+        if data.skipped:
+            print(
+                f"{variable}: {data.skipped} records are not numbers, only in the table"
+            )
+        if not data.times:
+            continue
+        x = np.frombuffer(data.times, dtype=np.float64)
+        y = np.frombuffer(data.values, dtype=np.float64)
+        selected = lttb(x, y, report_points)
+        render_chart(charts, variable, data.unit, x[selected], y[selected], len(x))
+        print(f"{variable}: {len(x)} values drawn with {len(selected)} points")
 
-    # start the PDF service
-    pdfService = Services({"token": context.token}).PDF
-    pdf_base64 = pdfService.generate(
+    head = []
+    REPORT_HEAD.render_into(
+        head,
         {
-            "base64": base_64,
-            "options": options,
-        }
+            "issue_date": datetime.now().strftime(DATE_FORMAT),
+            "start_date": first_time.strftime(DATE_FORMAT) if first_time else "-",
+            "stop_date": last_time.strftime(DATE_FORMAT) if last_time else "-",
+            "variables": ", ".join(variables),
+            "device_name": device_name,
+        },
     )
+    print(f"Report rendered with {counter} records")
 
-    # Start the email service
-    emailService = Services({"token": context.token}).email
+    return [*head, *rows, REPORT_TABLE_END, *charts, REPORT_TAIL]
 
-    # Send the email.
-    emailService.send(
+
+def encode_base64(pieces: list[str]) -> str:
+    """Base64 encode the HTML pieces in chunks.
+
+    The list is emptied while it is encoded, so each piece is released as soon as
+    its bytes are part of the encoded output. The encoded chunks and the joined string
+    exist together at the end, so the peak is about twice the size of the result.
+
+    Args:
+        pieces (list[str]): Pieces of the HTML, in order
+
+    Returns:
+        str: The whole HTML in base64
+    """
+    encoded = []
+    pending = bytearray()
+    pieces.reverse()
+    while pieces:
+        pending += pieces.pop().encode("utf-8")
+        if len(pending) < BASE64_CHUNK_SIZE:
+            continue
+
+        # Only whole groups of 3 bytes can be encoded without padding.
+        size = len(pending) - len(pending) % 3
+        with memoryview(pending) as view:
+            encoded.append(base64.b64encode(view[:size]).decode("ascii"))
+        del pending[:size]
+
+    encoded.append(base64.b64encode(pending).decode("ascii"))
+    return "".join(encoded)
+
+
+class LocalPDFService:
+    """Stand-in for Services.PDF that posts the same request to another URL.
+
+    Use it to run the analysis against a local stub of the PDF service, for example
+    in load tests, without calling TagoIO.
+
+    Args:
+        url (str): URL that receives the PDF requests
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+    def generate(self, params: dict) -> requests.Response:
+        """Post the PDF request, like PDFService.generate does."""
+        return requests.post(self.url, json=params, timeout=120)
+
+
+def generate_pdf(
+    pdf_service: Union[PDFService, LocalPDFService], html_base64: str, options: dict
+) -> str:
+    """Generate the PDF and return it in base64.
+
+    Only the result is kept, so the HTTP response is released as soon as this returns.
+
+    Args:
+        pdf_service (PDFService | LocalPDFService): PDF service of the Services class,
+            or any object with the same generate method
+        html_base64 (str): The report HTML in base64
+        options (dict): PDF options
+
+    Returns:
+        str: The PDF in base64
+    """
+    response = pdf_service.generate({"base64": html_base64, "options": options})
+    result = response.json()
+    if not result.get("status"):
+        raise ValueError(f"PDF generation failed: {result.get('message')}")
+
+    return result["result"]
+
+
+def send_report(email_service, to: str, pdf_base64: str, device_name: str) -> None:
+    """Send the PDF report as an email attachment."""
+    email_service.send(
         {
-            "to": envVars["email"],
-            "subject": "Exported File from TagoIO",
+            "to": to,
+            "subject": f"Exported File from TagoIO - {device_name}",
             "message": "This is an example of a body message",
             "attachment": {
-                "archive": pdf_base64.json()["result"],
+                "archive": pdf_base64,
                 "type": "base64",
                 "filename": "exportedfile.pdf",
             },
         }
     )
 
+
+def list_devices_by_tag(account: Account, tag_key: str, tag_value: str) -> list[dict]:
+    """Get every device of the account that has the given tag.
+
+    Args:
+        account (Account): Instance of the Account class
+        tag_key (str): Key of the tag
+        tag_value (str): Value of the tag
+
+    Returns:
+        list[dict]: List of devices with id, name and tags
+    """
+    devices = []
+    page = 1
+    while True:
+        result = account.devices.listDevice(
+            {
+                "page": page,
+                "amount": DEVICE_PAGE_SIZE,
+                "fields": ["id", "name", "tags"],
+                "filter": {"tags": [{"key": tag_key, "value": tag_value}]},
+            }
+        )
+        devices.extend(result)
+        if len(result) < DEVICE_PAGE_SIZE:
+            return devices
+        page += 1
+
+
+def build_and_send_report(
+    device: dict,
+    account: Account,
+    services: Services,
+    pdf_service: Union[PDFService, LocalPDFService],
+    service_slots: threading.BoundedSemaphore,
+    env_vars: dict,
+) -> None:
+    """Build the report of one device of the batch and email it.
+
+    Args:
+        device (dict): Device with id, name and tags
+        account (Account): Instance of the Account class
+        services (Services): Instance of the Services class
+        pdf_service (PDFService | LocalPDFService): Service that generates the PDF
+        service_slots (threading.BoundedSemaphore): Limit of simultaneous service calls
+        env_vars (dict): Environment variables of the analysis
+    """
+    email_tag = next((tag for tag in device["tags"] if tag["key"] == "email"), None)
+    to = email_tag["value"] if email_tag else env_vars.get("email")
+    if not to:
+        raise ValueError(f"No email for the device {device['name']}")
+
+    records = iter_device_data(
+        partial(account.devices.getDeviceData, device["id"]),
+        DEVICE_VARIABLES,
+        env_vars.get("start_date") or "1 month",
+    )
+    report_points = int(env_vars.get("report_points") or 500)
+    html_pieces = render_report(
+        records, device["name"], DEVICE_VARIABLES, report_points
+    )
+    html_base64 = encode_base64(html_pieces)
+
+    with service_slots:
+        pdf_base64 = generate_pdf(pdf_service, html_base64, PDF_OPTIONS)
+    with service_slots:
+        send_report(services.email, to, pdf_base64, device["name"])
+
+
+def run_batch(context, env_vars: dict) -> None:
+    """Generate and email the report of every device with the given tag."""
+    if not env_vars.get("account_token"):
+        raise ValueError("account_token environment variable not found")
+
+    account = Account({"token": env_vars["account_token"]})
+    services = Services({"token": context.token})
+    pdf_service = services.PDF
+    if env_vars.get("pdf_service_url"):
+        pdf_service = LocalPDFService(env_vars["pdf_service_url"])
+
+    devices = list_devices_by_tag(account, env_vars["tag_key"], env_vars["tag_value"])
+    if not devices:
+        return print(
+            f"No device found with the tag {env_vars['tag_key']}={env_vars['tag_value']}"
+        )
+
+    max_workers = int(env_vars.get("max_workers") or 5)
+    service_slots = threading.BoundedSemaphore(
+        int(env_vars.get("service_concurrency") or 2)
+    )
+    print(f"Generating reports for {len(devices)} devices")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                build_and_send_report,
+                device,
+                account,
+                services,
+                pdf_service,
+                service_slots,
+                env_vars,
+            ): device
+            for device in devices
+        }
+        for future in as_completed(futures):
+            device = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                failed.append(device["name"])
+                print(f"[ERROR] {device['name']}: {error}")
+
+    print(f"Reports sent: {len(devices) - len(failed)} of {len(devices)}")
+    if failed:
+        print(f"Failed devices: {', '.join(failed)}")
+
+
+# The function myAnalysis will run when you execute your analysis
+def my_analysis(context: any, scope: list = None) -> None:
+    # reads the values from the environment and saves it in the variable envVars
+    envVars = envToJson(context.environment)
+
+    if envVars.get("tag_key") and envVars.get("tag_value"):
+        run_batch(context, envVars)
+        return
+
+    if not envVars.get("email"):
+        raise ValueError("email environment variable not found")
+    if not envVars.get("device_token"):
+        raise ValueError("device_token environment variable not found")
+
+    device = Device({"token": envVars["device_token"]})
+    device_name = device.info().get("name", "")
+
+    records = iter_device_data(
+        device.getData, DEVICE_VARIABLES, envVars.get("start_date") or "1 month"
+    )
+    report_points = int(envVars.get("report_points") or 500)
+    html_pieces = render_report(records, device_name, DEVICE_VARIABLES, report_points)
+
+    # start the PDF service
+    pdfService = Services({"token": context.token}).PDF
+    if envVars.get("pdf_service_url"):
+        pdfService = LocalPDFService(envVars["pdf_service_url"])
+    pdf_base64 = generate_pdf(pdfService, encode_base64(html_pieces), PDF_OPTIONS)
+
+    # Start the email service
+    emailService = Services({"token": context.token}).email
+
+    # Send the email.
+    send_report(emailService, envVars["email"], pdf_base64, device_name)
+
     print("Email sent successfully")
 
 
@@ -0,0 +1,169 @@
+# @title: Concurrent HTTP Requests
+# @description: Query many external APIs at the same time with limits, timeouts and retries
+# @tags: http, get, api, request, external, async, concurrency
+
+# /// script
+# dependencies = [
+#   "tagoio-sdk",
+#   "aiohttp"
+# ]
+# ///
+
+"""
+Analysis Example
+Concurrent HTTP requests
+
+Integrations often need data from many third-party services in the same run, such as
+weather, ERP or billing APIs. Requesting them one after another makes the analysis take
+the sum of all the response times.
+
+This analysis requests every endpoint at the same time with asyncio, so the run takes
+about as long as the slowest endpoint. The amount of simultaneous requests is limited in
+total and for each host, every request has a timeout, and failed requests are retried
+after a random delay that grows on each attempt. The timeout starts when the request
+gets a connection, so the requests waiting for a free connection to a busy host don't
+time out. The results are handled as soon as each request completes, and any answer
+with an error status, such as 404, counts as a failed request.
+
+Environment Variables
+endpoints: URLs to request, comma separated.
+max_concurrency: Simultaneous requests in total (OPTIONAL, default: 20).
+max_per_host: Simultaneous requests to the same host (OPTIONAL, default: 5).
+timeout: Seconds to wait to connect and for each read (OPTIONAL, default: 10).
+max_attempts: Attempts for each request (OPTIONAL, default: 3).
+"""
+
+import asyncio
+import random
+import time
+from collections.abc import AsyncIterator
+
+import aiohttp
+from tagoio_sdk import Analysis
+from tagoio_sdk.modules.Utils.envToJson import envToJson
+
+# HTTP status codes worth trying again.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+async def fetch(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    url: str,
+    max_attempts: int,
+    backoff: float = 0.5,
+) -> dict:
+    """Request one URL, retrying with exponential backoff and full jitter.
+
+    Args:
+        session (aiohttp.ClientSession): Session with the connection limits and timeout
+        semaphore (asyncio.Semaphore): Limit of simultaneous requests
+        url (str): URL to request
+        max_attempts (int): Attempts for the request
+        backoff (float): Maximum delay before the first retry, doubled on each retry
+
+    Returns:
+        dict: url, status, body, error when it failed, attempts and elapsed seconds
+    """
+    start = time.monotonic()
+    result = {"url": url}
+    for attempt in range(1, max_attempts + 1):
+        result["attempts"] = attempt
+        try:
+            async with semaphore, session.get(url) as response:
+                result["status"] = response.status
+                if response.status not in RETRY_STATUS:
+                    result["body"] = await response.text()
+                    result.pop("error", None)
+                    # Other errors, such as 404 or 401, won't change by trying again.
+                    if response.status >= 400:
+                        result["error"] = f"HTTP {response.status}"
+                    break
+                result["error"] = f"HTTP {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            result["error"] = str(error) or type(error).__name__
+
+        if attempt < max_attempts:
+            await asyncio.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
+
+    result["elapsed"] = time.monotonic() - start
+    return result
+
+
+async def fetch_all(
+    urls: list[str],
+    max_concurrency: int = 20,
+    max_per_host: int = 5,
+    timeout: float = 10,
+    max_attempts: int = 3,
+) -> AsyncIterator[dict]:
+    """Request every URL at the same time and yield the results as they complete.
+
+    Args:
+        urls (list[str]): URLs to request
+        max_concurrency (int): Simultaneous requests in total
+        max_per_host (int): Simultaneous connections to the same host
+        timeout (float): Seconds to wait to connect and for each read of a response
+        max_attempts (int): Attempts for each request
+
+    Yields:
+        dict: Result of each request, in the order they complete
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency, limit_per_host=max_per_host)
+    # A total timeout would also count the time waiting for a connection of the pool.
+    client_timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=timeout, sock_read=timeout
+    )
+
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        tasks = [
+            asyncio.ensure_future(fetch(session, semaphore, url, max_attempts))
+            for url in urls
+        ]
+        for task in asyncio.as_completed(tasks):
+            yield await task
+
+
+async def run_requests(urls: list[str], environment: dict) -> list[dict]:
+    """Request the URLs with the limits of the environment variables."""
+    results = []
+    async for result in fetch_all(
+        urls,
+        max_concurrency=int(environment.get("max_concurrency") or 20),
+        max_per_host=int(environment.get("max_per_host") or 5),
+        timeout=float(environment.get("timeout") or 10),
+        max_attempts=int(environment.get("max_attempts") or 3),
+    ):
+        # Handle each response here, as soon as it arrives.
+        status = result.get("error") or result.get("status")
+        print(f"{result['url']}: {status} in {result['elapsed']:.2f}s")
+        results.append(result)
+    return results
+
+
+def my_analysis(context, scope: list = None) -> None:
+    environment = envToJson(context.environment)
+
+    urls = [
+        url.strip()
+        for url in environment.get("endpoints", "").split(",")
+        if url.strip()
+    ]
+    if not urls:
+        raise ValueError("Missing 'endpoints' in the environment variables")
+
+    start = time.monotonic()
+    results = asyncio.run(run_requests(urls, environment))
+    failed = [result for result in results if "error" in result]
+
+    print(
+        f"{len(results) - len(failed)} of {len(results)} requests succeeded "
+        f"in {time.monotonic() - start:.2f}s"
+    )
+
+
+# The analysis token in only necessary to run the analysis outside TagoIO
+Analysis(params={"token": "MY-ANALYSIS-TOKEN-HERE"}).init(my_analysis)
@@ -16,32 +16,170 @@ This analysis simple post to an HTTP route. It's a starting example for you to d
 complex algorithms.
 Follow the link of documentation https://api.docs.tago.io/
 In this example we get the Account name and print to the console.
+
+The requests go through CachedHTTPClient, which keeps the connections open between
+requests to the same host and stores the responses on disk with their ETag and
+Last-Modified headers. The next request for the same URL asks the server whether the
+response changed, and a "304 Not Modified" answer is served from the disk cache. The
+cache files are replaced atomically, and a 304 without a usable cache repeats the request
+without the conditional headers.
+Analyses that poll the same API every minute then mostly download nothing. The client is
+created once for each cache folder and kept between the runs of the analysis, so the runs
+in the same process reuse its open connections.
+
+Environment Variables
+account_token: Your account token.
+cache_dir: Folder of the response cache (OPTIONAL, default: a folder in the temp directory).
+timeout: Seconds to wait for each request (OPTIONAL, default: 10).
 """
 
-import urllib.request
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
 
+import requests
+from requests.adapters import HTTPAdapter
 from tagoio_sdk import Analysis
 
-
 URL_TAGOIO = "https://api.tago.io/info"
 
 
+class CachedHTTPClient:
+    """HTTP client with a keep-alive connection pool and a conditional request cache.
+
+    Args:
+        cache_dir (str): Folder where the responses are stored
+        timeout (float): Seconds to wait for the connection and for the response
+        pool_size (int): Connections kept open for each host
+    """
+
+    def __init__(
+        self, cache_dir: str, timeout: float = 10, pool_size: int = 10
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _cache_path(self, url: str, headers: dict) -> str:
+        key = json.dumps([url, sorted(headers.items())])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest())
+
+    def _write(self, path: str, content: bytes) -> None:
+        # Written to a temporary file first, so a run never reads a partial file.
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as temporary_file:
+                temporary_file.write(content)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def _read_cached(self, path: str) -> Optional[tuple[dict, bytes]]:
+        """Metadata and body of the cached response, None when it's missing or partial."""
+        try:
+            with open(path + ".json") as meta_file:
+                meta = json.load(meta_file)
+            with open(path + ".body", "rb") as body_file:
+                body = body_file.read()
+        except (OSError, ValueError):
+            return None
+        # The body must be the one the metadata was saved with.
+        if meta.get("sha256") != hashlib.sha256(body).hexdigest():
+            return None
+        return meta, body
+
+    def get(self, url: str, headers: dict = None, timeout: float = None) -> bytes:
+        """GET the URL, answering from the disk cache when the server returns 304.
+
+        Args:
+            url (str): URL to request
+            headers (dict): Request headers, also part of the cache key
+            timeout (float): Seconds to wait for this request (OPTIONAL)
+
+        Returns:
+            bytes: The response body
+        """
+        headers = headers or {}
+        timeout = timeout or self.timeout
+        path = self._cache_path(url, headers)
+
+        cached = self._read_cached(path)
+        conditional_headers = {}
+        if cached:
+            if cached[0].get("etag"):
+                conditional_headers["If-None-Match"] = cached[0]["etag"]
+            if cached[0].get("last_modified"):
+                conditional_headers["If-Modified-Since"] = cached[0]["last_modified"]
+
+        response = self.session.get(
+            url, headers={**headers, **conditional_headers}, timeout=timeout
+        )
+
+        if response.status_code == 304:
+            # The cache may have been removed since it was read.
+            cached = self._read_cached(path) if cached else None
+            if cached:
+                return cached[1]
+            response = self.session.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304:
+                raise requests.HTTPError(
+                    f"304 Not Modified without a cached response for {url}",
+                    response=response,
+                )
+
+        response.raise_for_status()
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            meta = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "sha256": hashlib.sha256(response.content).hexdigest(),
+            }
+            self._write(path + ".body", response.content)
+            self._write(path + ".json", json.dumps(meta).encode())
+
+        return response.content
+
+
+# Clients by cache folder, kept between runs so their connections stay open.
+CLIENTS: dict[str, CachedHTTPClient] = {}
+
+
+def get_client(cache_dir: str) -> CachedHTTPClient:
+    """Get the client of the cache folder, creating it on the first run."""
+    if cache_dir not in CLIENTS:
+        CLIENTS[cache_dir] = CachedHTTPClient(cache_dir)
+    return CLIENTS[cache_dir]
+
+
 def my_analysis(context, scope: list = None) -> dict:
-    account_token = next(
-        (item for item in context.environment if item["key"] == "account_token"), None
-    )
+    environment = {item["key"]: item["value"] for item in context.environment}
 
-    if not account_token:
+    if not environment.get("account_token"):
         raise ValueError("Missing 'account_token' in the environment variables")
 
-    headers = {"Authorization": account_token["value"]}
+    headers = {"Authorization": environment["account_token"]}
 
-    req = urllib.request.Request(URL_TAGOIO, headers=headers, method="GET")
+    client = get_client(
+        environment.get("cache_dir")
+        or os.path.join(tempfile.gettempdir(), "tagoio-http-cache")
+    )
+    timeout = float(environment.get("timeout") or 10)
 
     try:
-        with urllib.request.urlopen(req) as response:
-            result = response.read().decode("utf-8")
-            print(result)
+        result = client.get(URL_TAGOIO, headers=headers, timeout=timeout)
+        result = result.decode("utf-8")
+        print(result)
     except Exception as error:
         print(f"{error}")
 
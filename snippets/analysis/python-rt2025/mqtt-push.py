@@ -17,14 +17,79 @@ If you want more details about MQTT, search "MQTT" in TagoIO help center.
 You can find plenty of documentation about this topic.
 TagoIO Team.
 
+Every 'push_payload' in the scope is converted and grouped by device and topic, so each
+device receives a single message with all of its values, instead of one message per value.
+
 How to use?
 In order to trigger this analysis you must setup a Dashboard.
 Create a Widget "Form" and enter the variable 'push_payload' for the device you want to push with the MQTT.
 In User Control, select this Analysis in the Analysis Option.
 Save and use the form.
+
+Environment Variables
+codec: How the messages are encoded (OPTIONAL, default: json).
+  json: compact JSON text.
+  msgpack: MessagePack in base64. Add "msgpack" to the dependencies above to use it.
+  cbor: CBOR in base64. Add "cbor2" to the dependencies above to use it.
 """
 
+import base64
+import json
+from collections import defaultdict
+
 from tagoio_sdk import Analysis, Services
+from tagoio_sdk.modules.Utils.envToJson import envToJson
+
+DEFAULT_TOPIC = "tago/my_topic"
+
+
+def encode_json(messages: list[dict]) -> str:
+    return json.dumps(messages, separators=(",", ":"))
+
+
+def encode_msgpack(messages: list[dict]) -> str:
+    import msgpack
+
+    return base64.b64encode(msgpack.packb(messages)).decode("ascii")
+
+
+def encode_cbor(messages: list[dict]) -> str:
+    import cbor2
+
+    return base64.b64encode(cbor2.dumps(messages)).decode("ascii")
+
+
+CODECS = {"json": encode_json, "msgpack": encode_msgpack, "cbor": encode_cbor}
+
+
+def group_messages(scope: list[dict]) -> dict[tuple[str, str], list[dict]]:
+    """Create the message of every 'push_payload' and group them by device and topic.
+
+    Args:
+        scope (list[dict]): Scope of the analysis
+
+    Returns:
+        dict[tuple[str, str], list[dict]]: Messages by (device, topic)
+    """
+    groups = defaultdict(list)
+    for item in scope:
+        if item.get("variable") != "push_payload":
+            continue
+
+        # Create your data object to push to MQTT
+        # In this case we're sending a JSON object.
+        # You can send anything you want.
+        my_data_object = {
+            "variable": "temperature_celsius",
+            "value": (float(item["value"]) - 32) * (5 / 9),
+            "unit": "C",
+        }
+
+        topic = (item.get("metadata") or {}).get("topic", DEFAULT_TOPIC)
+        # bucket: item["bucket"] for legacy devices
+        groups[(item["device"], topic)].append(my_data_object)
+
+    return groups
 
 
 # The function myAnalysis will run when you execute your analysis
@@ -32,20 +97,15 @@ def my_analysis(context, scope: list[dict]) -> None:
     if not scope:
         return print("This analysis must be triggered by a dashboard.")
 
-    my_data = [obj for obj in scope if obj["variable"] == "push_payload"]
-    if not my_data:
-        return print("Couldn't find any variable in the scope.")
+    environment = envToJson(context.environment)
+    codec = environment.get("codec") or "json"
+    if codec not in CODECS:
+        raise ValueError(f"Invalid codec '{codec}'. Use one of: {', '.join(CODECS)}")
+    encode = CODECS[codec]
 
-    # Create your data object to push to MQTT
-    # In this case we're sending a JSON object.
-    # You can send anything you want.
-    # Example:
-    # const myDataObject = 'This is a string';
-    my_data_object = {
-        "variable": "temperature_celsius",
-        "value": (int(my_data[0]["value"]) - 32) * (5 / 9),
-        "unit": "C",
-    }
+    groups = group_messages(scope)
+    if not groups:
+        return print("Couldn't find any variable in the scope.")
 
     # Create a object with the options you chooses
     options = {
@@ -53,18 +113,18 @@ def my_analysis(context, scope: list[dict]) -> None:
         "qos": 0,
     }
 
-    # Publishing to MQTT
+    # Publishing to MQTT, one message for each device and topic
     MQTT = Services({"token": context.token}).MQTT
-    result = MQTT.publish(
-        {
-            # bucket: myData.bucket, // for legacy devices
-            "bucket": my_data[0]["device"],  # for immutable/mutable devices
-            "message": str(my_data_object),
-            "topic": "tago/my_topic",
-            "options": options,
-        }
-    )
-    print(result)
+    for (device, topic), messages in groups.items():
+        result = MQTT.publish(
+            {
+                "bucket": device,  # for immutable/mutable devices
+                "message": encode(messages),
+                "topic": topic,
+                "options": options,
+            }
+        )
+        print(f"{device} {topic}: {len(messages)} values - {result}")
 
 
 # The analysis token in only necessary to run the analysis outside TagoIO
@@ -0,0 +1,147 @@
+# @title: Structured Logger
+# @description: Write batched, redacted console messages with fields and timed spans
+# @tags: console, logging, debug, performance, security
+
+# /// script
+# dependencies = [
+#   "tagoio-sdk"
+# ]
+# ///
+
+"""
+Analysis Example
+Structured logger
+
+Send structured messages to the console located on the TagoIO analysis screen. For the
+basics of the console, start with the Console Hello World example.
+
+Each print is a separate message in the console, so this example uses a small Logger
+that keeps the lines and writes them together, in batches. Each line is a message followed
+by key=value fields, and the tokens are replaced by *** before anything is written.
+Wrap the slow parts of your analysis in "with logger.span(name):" and the time of each
+part is shown in the summary at the end of the run. The summary runs in a finally block,
+so the lines logged before an error are still written.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from tagoio_sdk import Analysis
+
+# TagoIO tokens are UUIDs, such as the device and account tokens.
+TOKEN_PATTERN = re.compile(
+    r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE
+)
+SECRET_KEYS = ("token", "password", "secret", "authorization")
+
+
+def is_secret_key(key: str) -> bool:
+    return any(secret in key.lower() for secret in SECRET_KEYS)
+
+
+class Logger:
+    """Console logger that writes in batches, redacts tokens and times spans.
+
+    Args:
+        secrets (list[str]): Values replaced by *** in every line
+        batch_size (int): Lines written together in a single console message
+    """
+
+    def __init__(self, secrets: list[str] = (), batch_size: int = 50) -> None:
+        self.secrets = [secret for secret in secrets if secret]
+        self.batch_size = batch_size
+        self.lines = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def redact(self, text: str) -> str:
+        for secret in self.secrets:
+            text = text.replace(secret, "***")
+        return TOKEN_PATTERN.sub("***", text)
+
+    def log(self, message: str, /, **fields) -> None:
+        """Add a line with the message and its fields, such as: getData qty=10.
+
+        The message is positional only, so a field can also be named message.
+        """
+        parts = [message]
+        for key, value in fields.items():
+            if is_secret_key(key):
+                value = "***"
+            elif not isinstance(value, (int, float)):
+                value = json.dumps(value, default=str, separators=(",", ":"))
+            parts.append(f"{key}={value}")
+
+        with self.lock:
+            self.lines.append(self.redact(" ".join(parts)))
+            if len(self.lines) < self.batch_size:
+                return
+            lines, self.lines = self.lines, []
+        print("\n".join(lines))
+
+    def flush(self) -> None:
+        with self.lock:
+            lines, self.lines = self.lines, []
+        if lines:
+            print("\n".join(lines))
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the code inside the with block and add it to the summary."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.durations[name] += elapsed
+                self.counts[name] += 1
+
+    def summary(self) -> None:
+        """Log the time of the run and of each span, and write the pending lines."""
+        fields = {"total_ms": round((time.perf_counter() - self.start) * 1000, 1)}
+        for name, duration in sorted(self.durations.items(), key=lambda x: -x[1]):
+            fields[f"{name}_ms"] = round(duration * 1000, 1)
+            if self.counts[name] > 1:
+                fields[f"{name}_calls"] = self.counts[name]
+        self.log("summary", **fields)
+        self.flush()
+
+
+# The function myAnalysis will run when you execute your analysis
+def myAnalysis(context, scope: list) -> None:
+    environment = {item["key"]: item["value"] for item in context.environment}
+
+    # The values of the environment variables with secret names are never written.
+    secrets = [value for key, value in environment.items() if is_secret_key(key)]
+    logger = Logger(secrets=[context.token, *secrets])
+
+    try:
+        # This will log "Hello World" at the TagoIO Analysis console
+        logger.log("Hello World")
+
+        #  This will log the environment to the TagoIO Analysis console
+        logger.log("environment", **environment)
+
+        #  This will log the scope to the TagoIO Analysis console, one line for each record
+        with logger.span("scope"):
+            for item in scope or []:
+                logger.log(
+                    "scope",
+                    variable=item.get("variable"),
+                    value=item.get("value"),
+                    device=item.get("device"),
+                )
+    finally:
+        # Writes the pending lines even when the analysis raises an error.
+        logger.summary()
+
+
+# The analysis token in only necessary to run the analysis outside TagoIO
+Analysis({"token": "MY-ANALYSIS-TOKEN-HERE"}).init(myAnalysis)
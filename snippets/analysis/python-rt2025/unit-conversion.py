@@ -0,0 +1,218 @@
+# @title: Unit Conversion
+# @description: Convert temperature, pressure and volume data between metric and imperial units
+# @tags: unit, conversion, temperature, pressure, volume, numpy
+
+# /// script
+# dependencies = [
+#   "tagoio-sdk",
+#   "numpy"
+# ]
+# ///
+
+"""
+Analysis Example
+Unit conversion
+
+Convert the data of a device to the metric or the imperial unit system, and store the
+converted values in new variables.
+
+The conversion factors between every pair of units are calculated once, when the analysis
+starts. The records are grouped by unit and each group is converted with a single numpy
+operation, so thousands of readings are converted at once instead of one by one.
+The converted records keep their time, group and metadata, with the new unit and the
+original unit in metadata.original_unit.
+
+When this analysis is triggered by an action, it converts the data in the scope, only of
+the "variables" when that environment variable is set. The converted variables written by
+this analysis, such as temperature_metric, are never converted again, so an action on the
+data of the device doesn't trigger the analysis in a loop.
+Otherwise it converts the last value of each variable in the "variables" environment variable.
+
+Environment Variables
+In order to use this analysis, you must setup the Environment Variable table.
+
+device_token: Token of the device that receives the converted variables.
+unit_system: metric or imperial (OPTIONAL, default: metric).
+variables: Variables to convert, comma separated. Required when there is no scope (OPTIONAL).
+"""
+
+from collections import defaultdict
+
+import numpy as np
+from tagoio_sdk import Analysis, Device
+from tagoio_sdk.modules.Utils.envToJson import envToJson
+
+# unit: (quantity, scale, offset) so that value * scale + offset is in the base unit
+# of the quantity: Celsius, Pascal and Liter.
+UNITS = {
+    "C": ("temperature", 1.0, 0.0),
+    "°C": ("temperature", 1.0, 0.0),
+    "F": ("temperature", 5 / 9, -32 * 5 / 9),
+    "°F": ("temperature", 5 / 9, -32 * 5 / 9),
+    "K": ("temperature", 1.0, -273.15),
+    "Pa": ("pressure", 1.0, 0.0),
+    "hPa": ("pressure", 100.0, 0.0),
+    "mbar": ("pressure", 100.0, 0.0),
+    "kPa": ("pressure", 1000.0, 0.0),
+    "bar": ("pressure", 100000.0, 0.0),
+    "atm": ("pressure", 101325.0, 0.0),
+    "psi": ("pressure", 6894.757293168, 0.0),
+    "inHg": ("pressure", 3386.389, 0.0),
+    "mL": ("volume", 0.001, 0.0),
+    "L": ("volume", 1.0, 0.0),
+    "m3": ("volume", 1000.0, 0.0),
+    "m³": ("volume", 1000.0, 0.0),
+    "gal": ("volume", 3.785411784, 0.0),
+    "ft3": ("volume", 28.316846592, 0.0),
+    "ft³": ("volume", 28.316846592, 0.0),
+    "fl oz": ("volume", 0.0295735295625, 0.0),
+}
+
+UNIT_SYSTEMS = {
+    "metric": {"temperature": "C", "pressure": "kPa", "volume": "L"},
+    "imperial": {"temperature": "F", "pressure": "psi", "volume": "gal"},
+}
+
+
+def build_conversions() -> dict[tuple[str, str], tuple[float, float]]:
+    """Calculate the (scale, offset) from every unit to every unit of the same quantity."""
+    conversions = {}
+    for source, (quantity, source_scale, source_offset) in UNITS.items():
+        for target, (target_quantity, target_scale, target_offset) in UNITS.items():
+            if quantity != target_quantity:
+                continue
+            conversions[(source, target)] = (
+                source_scale / target_scale,
+                (source_offset - target_offset) / target_scale,
+            )
+    return conversions
+
+
+CONVERSIONS = build_conversions()
+
+
+def convert_values(values, source: str, target: str) -> np.ndarray:
+    """Convert an array of values from one unit to another.
+
+    Args:
+        values (array-like): Values in the source unit
+        source (str): Unit of the values
+        target (str): Unit to convert to
+
+    Returns:
+        np.ndarray: Values in the target unit
+    """
+    scale, offset = CONVERSIONS[(source, target)]
+    return np.asarray(values, dtype=np.float64) * scale + offset
+
+
+def convert_records(records: list[dict], unit_system: str) -> list[dict]:
+    """Convert records to the units of a unit system.
+
+    Records without a known unit or without a numeric value are left out. Records
+    already in the target unit keep their value.
+
+    Args:
+        records (list[dict]): Records from the scope or from getData
+        unit_system (str): metric or imperial
+
+    Returns:
+        list[dict]: The converted records, in the same order
+    """
+    targets = UNIT_SYSTEMS[unit_system]
+
+    # Group the position of the records by unit, so each unit is converted at once.
+    by_unit = defaultdict(list)
+    values = np.zeros(len(records))
+    valid = np.zeros(len(records), dtype=bool)
+    for position, record in enumerate(records):
+        if record.get("unit") not in UNITS:
+            continue
+        try:
+            values[position] = float(record.get("value"))
+        except (TypeError, ValueError):
+            continue
+        valid[position] = True
+        by_unit[record["unit"]].append(position)
+
+    target_units = {}
+    for unit, positions in by_unit.items():
+        target_units[unit] = targets[UNITS[unit][0]]
+        values[positions] = convert_values(values[positions], unit, target_units[unit])
+
+    return [
+        {
+            **record,
+            "value": value,
+            "unit": target_units[record["unit"]],
+            "metadata": {
+                **(record.get("metadata") or {}),
+                "original_unit": record["unit"],
+            },
+        }
+        for record, value, is_valid in zip(records, values.tolist(), valid.tolist())
+        if is_valid
+    ]
+
+
+def is_converted(record: dict) -> bool:
+    """Whether the record was written by this analysis, such as temperature_metric."""
+    if (record.get("metadata") or {}).get("original_unit"):
+        return True
+    variable = record.get("variable") or ""
+    return any(variable.endswith(f"_{system}") for system in UNIT_SYSTEMS)
+
+
+def my_analysis(context, scope: list = None) -> None:
+    environment = envToJson(context.environment)
+
+    if not environment.get("device_token"):
+        raise ValueError("Missing 'device_token' in the environment variables")
+
+    unit_system = environment.get("unit_system") or "metric"
+    if unit_system not in UNIT_SYSTEMS:
+        raise ValueError(
+            f"Invalid unit_system '{unit_system}'. Use metric or imperial."
+        )
+
+    device = Device({"token": environment["device_token"]})
+    variables = [
+        variable.strip()
+        for variable in environment.get("variables", "").split(",")
+        if variable.strip()
+    ]
+
+    if scope:
+        records = [
+            record
+            for record in scope
+            if not is_converted(record)
+            and (not variables or record.get("variable") in variables)
+        ]
+    elif variables:
+        records = device.getData({"variables": variables, "query": "last_value"})
+    else:
+        return print("No scope and no 'variables' environment variable to convert.")
+
+    converted = convert_records(records, unit_system)
+    if not converted:
+        return print("No record with a known unit to convert.")
+
+    # Save the converted values in new variables, such as temperature_metric.
+    data = [
+        {
+            "variable": f"{record['variable']}_{unit_system}",
+            "value": record["value"],
+            "unit": record["unit"],
+            "time": record.get("time"),
+            "group": record.get("group"),
+            "metadata": record["metadata"],
+        }
+        for record in converted
+    ]
+    result = device.sendData(data=data)
+    print(f"{len(data)} records converted to {unit_system}: {result}")
+
+
+# The analysis token in only necessary to run the analysis outside TagoIO
+Analysis(params={"token": "MY-ANALYSIS-TOKEN-HERE"}).init(my_analysis)